@@ -0,0 +1,177 @@
+"""
+This module contains the BatchRecommender class, which generates recommendations for many lists of seed songs
+at once in a pool of worker processes, for jobs that generate recommendations for thousands of users.
+"""
+from __future__ import annotations
+
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from recommendation_system import DEFAULT_RECOMMENDATION_COUNT, RecommendationSystem
+from worker_pool import run_in_worker, worker_pool
+
+# The number of seed lists sent to a worker process at once
+BATCH_CHUNK_SIZE = 64
+# The number of chunks waiting for or being processed by each worker process at any time
+CHUNKS_PER_WORKER = 2
+
+
+def _batch_worker(options: dict[str, Any]) -> Callable[[list[list], int], list[list[list[tuple[str, str, float]]]]]:
+    """Return the task of a worker process of a BatchRecommender, which recommends songs for a chunk of seed lists
+    with a RecommendationSystem(**options) created once in the worker. See worker_pool.
+    """
+    return partial(_recommend_chunk, RecommendationSystem(**options))
+
+
+def _recommend_chunk(system: RecommendationSystem, seed_lists: list[list],
+                     n: int) -> list[list[list[tuple[str, str, float]]]]:
+    """Return the recommendations of the given recommendation system for each of the given seed lists."""
+    return [system.generate_recommendations(seed_list, n) for seed_list in seed_lists]
+
+
+class BatchRecommender:
+    """A pool of worker processes that each hold a RecommendationSystem, and generate recommendations
+    for many seed lists in parallel.
+
+    Every worker loads its recommendation system once, when the pool is created. By default, the song graph is
+    memory-mapped from the snapshot, so all the workers share one copy of it.
+
+    Instance Attributes:
+        - workers: The number of worker processes, where 1 means the recommendations are generated in this process
+        - chunk_size: The number of seed lists sent to a worker process at once
+        - seed_lists: The number of seed lists that recommendations were generated for
+        - recommendations: The number of songs recommended in total
+        - seconds: The seconds spent generating recommendations
+
+    Representation Invariants:
+        - self.workers > 0
+        - self.chunk_size > 0
+    """
+    workers: int
+    chunk_size: int
+    seed_lists: int
+    recommendations: int
+    seconds: float
+    # Private Instance Attributes:
+    #   - _system:
+    #       The recommendation system used when there is a single worker
+    #   - _executor:
+    #       The pool of worker processes, or None if there is a single worker
+    _system: Optional[RecommendationSystem]
+    _executor: Optional[ProcessPoolExecutor]
+
+    def __init__(self, workers: int = 1, chunk_size: int = BATCH_CHUNK_SIZE, mmap_graph: bool = True,
+                 **options: Any) -> None:
+        """Start a pool of the given number of worker processes, each holding a
+        RecommendationSystem(mmap_graph=mmap_graph, **options).
+
+        The recommendation system is created once in this process first, so that the snapshot and the
+        recommendation table it uses are up to date before the workers load them. It is only kept when there is
+        a single worker.
+
+        Preconditions:
+            - workers > 0
+            - chunk_size > 0
+            - options are keyword arguments of RecommendationSystem
+        """
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.seed_lists = 0
+        self.recommendations = 0
+        self.seconds = 0.0
+        options['mmap_graph'] = mmap_graph
+        system = RecommendationSystem(**options)
+        if workers > 1:
+            self._system = None
+            self._executor = worker_pool(workers, _batch_worker, options)
+        else:
+            self._system = system
+            self._executor = None
+
+    def recommend(self, seed_lists: Iterable[list],
+                  n: int = DEFAULT_RECOMMENDATION_COUNT) -> Iterator[list[list[tuple[str, str, float]]]]:
+        """Yield RecommendationSystem.generate_recommendations(seed_list, n) for each of the given seed lists,
+        in the same order as the seed lists.
+
+        The seed lists are read and sent to the workers in chunks of chunk_size as the results are consumed,
+        with at most CHUNKS_PER_WORKER chunks per worker at a time, so a very long iterable of seed lists
+        is never held in memory at once.
+
+        Preconditions:
+            - n > 0
+        """
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                for seed_list in seed_lists:
+                    recommendations = self._system.generate_recommendations(seed_list, n)
+                    self._count([recommendations])
+                    yield recommendations
+                return
+
+            pending = deque()
+            chunk = []
+            for seed_list in seed_lists:
+                chunk.append(seed_list)
+                if len(chunk) == self.chunk_size:
+                    pending.append(self._executor.submit(run_in_worker, _batch_worker, chunk, n))
+                    chunk = []
+                    if len(pending) >= self.workers * CHUNKS_PER_WORKER:
+                        yield from self._results(pending.popleft())
+            if chunk:
+                pending.append(self._executor.submit(run_in_worker, _batch_worker, chunk, n))
+            while pending:
+                yield from self._results(pending.popleft())
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def _results(self, future: Future) -> list[list[list[tuple[str, str, float]]]]:
+        """Return the results of the given chunk once it is finished, and count them in the statistics."""
+        results = future.result()
+        self._count(results)
+        return results
+
+    def _count(self, results: list[list[list[tuple[str, str, float]]]]) -> None:
+        """Count the given results of generate_recommendations in the statistics of this batch recommender."""
+        self.seed_lists += len(results)
+        self.recommendations += sum(len(bucket) for result in results for bucket in result)
+
+    def statistics(self) -> dict[str, float]:
+        """Return a dictionary with the number of seed lists and songs recommended so far,
+        the seconds spent on them, and the number of seed lists per second.
+
+        The seconds include the time the caller spent between consuming the results of recommend.
+        """
+        return {
+            'workers': self.workers,
+            'seed_lists': self.seed_lists,
+            'recommendations': self.recommendations,
+            'seconds': self.seconds,
+            'seed_lists_per_second': self.seed_lists / self.seconds if self.seconds > 0 else 0.0
+        }
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> BatchRecommender:
+        """Return this batch recommender, which is closed at the end of the with statement."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close this batch recommender."""
+        self.close()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['time', 'collections', 'concurrent.futures', 'functools', 'recommendation_system',
+                          'worker_pool'],
+        'max-line-length': 120,
+    })
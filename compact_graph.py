@@ -0,0 +1,270 @@
+"""
+This module contains the CompactSongGraph class, a read-only song graph stored in typed arrays
+rather than in vertex objects. It is either frozen from a SongGraph once its edges are built, or memory-mapped
+from a snapshot file and shared between processes.
+"""
+from __future__ import annotations
+
+from typing import Any, Iterator
+
+import numpy as np
+
+from search_cache import SearchCache
+from snapshot import STRING_SEPARATOR, decode_strings, encode_strings, read_snapshot
+from song_graph import (INTEGER_FEATURES, NUMERICAL_FEATURES, SongGraph, closest_rows, find_nearest_vertex_ids,
+                        iter_nearest_vertex_ids, song_artist)
+
+
+class CompactSongGraph:
+    """
+    A read-only graph representing songs and their similarities, with the same methods for reading
+    the graph as SongGraph.
+
+    The vertices are numbered from 0 to n - 1. The neighbours of vertex i are
+    neighbours[offsets[i]:offsets[i + 1]] and the scores of those edges are scores[offsets[i]:offsets[i + 1]].
+
+    Instance Attributes:
+        - vertex_ids: The vertex id of each vertex
+        - features: A matrix with the NUMERICAL_FEATURES of each vertex as its rows
+        - genres: The code of the genre of each vertex
+        - genre_names: The name of each genre code
+        - offsets: The start of the edges of each vertex in neighbours and scores, followed by the number of edges
+        - neighbours: The neighbouring vertex of each edge
+        - scores: The similarity score of each edge
+        - search_cache: The cache of the results of find_shortest_distance
+    """
+    vertex_ids: list[str]
+    features: np.ndarray
+    genres: np.ndarray
+    genre_names: list[str]
+    offsets: np.ndarray
+    neighbours: np.ndarray
+    scores: np.ndarray
+    search_cache: SearchCache
+    # Private Instance Attributes:
+    #   - _positions:
+    #       A dictionary mapping each vertex id to its vertex number
+    #   - _names, _artists:
+    #       The string tables storing the name and the ';' separated artists of each vertex
+    #   - _song_artists:
+    #       A dictionary mapping each vertex number to its interned (name, artists joined by '; '), as shown in
+    #       recommendations, which is only decoded from the string tables once get_song_artist is called for it
+    #   - _name_starts, _artist_starts:
+    #       The start of the string of each vertex in _names and _artists, followed by the length of the table + 1
+    #   - _offsets_view, _neighbours_view, _scores_view:
+    #       Memoryviews of offsets, neighbours and scores, which are much faster to index and slice from Python
+    _positions: dict[str, int]
+    _names: np.ndarray
+    _artists: np.ndarray
+    _song_artists: dict[int, tuple[str, str]]
+    _name_starts: np.ndarray
+    _artist_starts: np.ndarray
+    _offsets_view: memoryview
+    _neighbours_view: memoryview
+    _scores_view: memoryview
+
+    def __init__(self, arrays: dict[str, np.ndarray]) -> None:
+        """Initialize a graph from the given arrays, which were returned by SongGraph.to_arrays.
+
+        The arrays are used without being copied, so they may be memory-mapped from a snapshot file.
+        """
+        self.features = arrays['features']
+        self.genres = arrays['genres']
+        self.offsets = arrays['offsets']
+        self.neighbours = arrays['neighbours']
+        self.scores = arrays['scores']
+        self.vertex_ids = decode_strings(arrays['vertex_ids'], len(self.genres))
+        self.genre_names = decode_strings(arrays['genre_names'], int(self.genres.max(initial=-1)) + 1)
+        self._positions = {vertex_id: position for position, vertex_id in enumerate(self.vertex_ids)}
+        self._names = arrays['names']
+        self._artists = arrays['artists']
+        self._name_starts = _string_starts(self._names)
+        self._artist_starts = _string_starts(self._artists)
+        self._song_artists = {}
+        self._offsets_view = memoryview(np.ascontiguousarray(self.offsets))
+        self._neighbours_view = memoryview(np.ascontiguousarray(self.neighbours))
+        self._scores_view = memoryview(np.ascontiguousarray(self.scores))
+        self.search_cache = SearchCache()
+
+    @staticmethod
+    def from_graph(graph: SongGraph) -> CompactSongGraph:
+        """Return a read-only copy of the given graph, with its edges stored as compressed sparse rows of
+        int32 vertex numbers and float32 similarity scores instead of dictionaries of vertices.
+        """
+        arrays = graph.to_arrays()
+        arrays['neighbours'] = arrays['neighbours'].astype(np.int32)
+        arrays['scores'] = arrays['scores'].astype(np.float32)
+        return CompactSongGraph(arrays)
+
+    @staticmethod
+    def from_snapshot(path: str, fingerprint: str, mmap: bool = True) -> CompactSongGraph:
+        """Return the graph stored in the snapshot file at path, which was saved by generate_graph.save_snapshot.
+
+        If mmap is True, the arrays of the graph are memory-mapped from the file,
+        so every process that opens the same snapshot shares one physical copy of them.
+
+        Raise a ValueError if the file is not a snapshot or was saved with a different fingerprint.
+        """
+        arrays, _ = read_snapshot(path, fingerprint, mmap)
+        return CompactSongGraph({name[len('graph_'):]: array for name, array in arrays.items()
+                                 if name.startswith('graph_')})
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Return the vertices and edges of this graph in the same arrays as SongGraph.to_arrays."""
+        return {
+            'vertex_ids': encode_strings(self.vertex_ids),
+            'names': self._names,
+            'artists': self._artists,
+            'genre_names': encode_strings(self.genre_names),
+            'genres': self.genres,
+            'features': self.features,
+            'offsets': self.offsets,
+            'neighbours': self.neighbours,
+            'scores': self.scores
+        }
+
+    def _edges(self, position: int) -> tuple[list[int], list[float]]:
+        """Return the neighbours of the given vertex number and the scores of those edges."""
+        start, stop = self._offsets_view[position], self._offsets_view[position + 1]
+        return self._neighbours_view[start:stop].tolist(), self._scores_view[start:stop].tolist()
+
+    def has_vertex(self, vertex_id: str) -> bool:
+        """Returns whether the graph contains a vertex with the given vertex_id"""
+        return vertex_id in self._positions
+
+    def adjacent(self, vertex_id1: str, vertex_id2: str) -> bool:
+        """Return whether vertex_id1 and vertex_id2 are adjacent vertices in this graph.
+
+        Return False if vertex_id1 or vertex_id2 do not appear as vertices in this graph.
+        """
+        if vertex_id1 in self._positions and vertex_id2 in self._positions:
+            return self._positions[vertex_id2] in self._edges(self._positions[vertex_id1])[0]
+        else:
+            return False
+
+    def get_neighbours(self, vertex_id: str) -> dict[str, float]:
+        """Return a dictionary of the neighbours to similarity score of the given vertex_id.
+
+        Raise a ValueError if vertex_id does not appear as a vertex in this graph.
+        """
+        if vertex_id in self._positions:
+            neighbours, scores = self._edges(self._positions[vertex_id])
+            return {self.vertex_ids[neighbour]: score for neighbour, score in zip(neighbours, scores)}
+        else:
+            raise ValueError
+
+    def get_all_vertices(self) -> set:
+        """Return a set of all vertex vertex_ids in this graph.
+        """
+        return set(self.vertex_ids)
+
+    def iter_shortest_distances(self, orig_vertex_ids: list[str], n: int) -> Iterator[tuple[int, str, float]]:
+        """Yield (i, vertex_id, distance) for each item of find_shortest_distance(orig_vertex_ids[i], n),
+        as soon as it is found, the same way as SongGraph.iter_shortest_distances.
+
+        Preconditions:
+            - all(self.has_vertex(orig_vertex_id) for orig_vertex_id in orig_vertex_ids)
+            - n > 0
+        """
+        return iter_nearest_vertex_ids(lambda position: zip(*self._edges(position)), self._positions,
+                                       self.vertex_ids, orig_vertex_ids, n)
+
+    def get_song_artist(self, vertex_id: str) -> tuple[str, str]:
+        """Return the name of the song with the given vertex id and its artists joined by '; ',
+        as shown in recommendations. See SongGraph.get_song_artist.
+
+        The strings are decoded from the string tables the first time they are needed, and are then kept,
+        so only the songs that are recommended have a copy of their strings in this process.
+        """
+        position = self._positions[vertex_id]
+        if position not in self._song_artists:
+            self._song_artists[position] = song_artist(
+                _string_at(self._names, self._name_starts, position),
+                _string_at(self._artists, self._artist_starts, position).split(';'))
+        return self._song_artists[position]
+
+    def get_vertex_details(self, vertex_id: str) -> dict[str, Any]:
+        """
+        Given a vertex_id id, return the details of the vertex
+        """
+        position = self._positions[vertex_id]
+        details = {
+            'name': _string_at(self._names, self._name_starts, position),
+            'artists': set(_string_at(self._artists, self._artist_starts, position).split(';'))
+        }
+        for feature_name, value in zip(NUMERICAL_FEATURES, self.features[position].tolist()):
+            details[feature_name] = int(value) if feature_name in INTEGER_FEATURES else value
+        details['track_genre'] = self.genre_names[self.genres[position]]
+        return details
+
+    def find_closest_songs(self, track_genre: str, values: list[float], n: int) -> list[tuple[str, float]]:
+        """Return the vertex ids of the n songs most similar to a song in the given genre with the given
+        NUMERICAL_FEATURES values, with their similarity scores to it.
+
+        The songs and their order are the same as SongGraph.find_closest_songs.
+
+        Preconditions:
+            - len(values) == len(NUMERICAL_FEATURES)
+            - n > 0
+        """
+        genre = self.genre_names.index(track_genre) if track_genre in self.genre_names else -1
+        rows, scores = closest_rows(self.features, self.genres, values, genre, n)
+        return [(self.vertex_ids[row], score) for row, score in zip(rows.tolist(), scores.tolist())]
+
+    def get_average_edges(self) -> float:
+        """Returns the average number of edges per vertex.
+        Used to decide a value for the SCORE_LIMIT constant
+        """
+        return len(self.neighbours) / len(self.vertex_ids)
+
+    def get_degree_distribution(self) -> dict[int, int]:
+        """Return a dictionary mapping each degree to the number of vertices with that degree, in increasing order
+        of degree. The degree of a vertex is its number of neighbours.
+        """
+        degrees = np.bincount(np.diff(self.offsets), minlength=1)
+        return {degree: count for degree, count in enumerate(degrees.tolist()) if count > 0}
+
+    def find_shortest_distance(self, orig_vertex_id: str, n: int) -> list[tuple[Any, Any]]:
+        """
+        Given the id of a song in the graph, find n other songs that
+        are similar to the song and return their vertex_ids in a list.
+
+        The songs and their order are the same as SongGraph.find_shortest_distance.
+
+        Preconditions:
+            - self.has_vertex(orig_vertex_id)
+            - n > 0
+        """
+        return self.find_shortest_distances([orig_vertex_id], n)[0]
+
+    def find_shortest_distances(self, orig_vertex_ids: list[str], n: int) -> list[list[tuple[str, float]]]:
+        """Return find_shortest_distance(orig_vertex_id, n) for each of the given vertex ids.
+
+        The results are looked up in search_cache first, and the rest are computed with nearest_vertices,
+        then added to search_cache. See find_nearest_vertex_ids.
+
+        Preconditions:
+            - all(self.has_vertex(orig_vertex_id) for orig_vertex_id in orig_vertex_ids)
+            - n > 0
+        """
+        return find_nearest_vertex_ids(lambda position: zip(*self._edges(position)), self._positions,
+                                       self.vertex_ids, self.search_cache, orig_vertex_ids, n)
+
+
+def _string_starts(table: np.ndarray) -> np.ndarray:
+    """Return the start of each string in the given string table, followed by the length of the table + 1."""
+    separators = np.flatnonzero(table == ord(STRING_SEPARATOR))
+    return np.concatenate(([0], separators + 1, [len(table) + 1]))
+
+
+def _string_at(table: np.ndarray, starts: np.ndarray, index: int) -> str:
+    """Return the string at the given index of the string table, whose string starts are starts."""
+    return table[starts[index]:starts[index + 1] - 1].tobytes().decode('utf-8')
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['numpy', 'search_cache', 'snapshot', 'song_graph'],
+        'max-line-length': 120,
+    })
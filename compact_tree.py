@@ -0,0 +1,311 @@
+"""
+This module contains the CompactDecisionTree class, a read-only decision tree stored in typed arrays
+rather than in a SongDecisionTree object for every node. It is built once from the songs inserted into the tree,
+and can be saved to and memory-mapped from a snapshot file like a CompactSongGraph.
+"""
+from __future__ import annotations
+
+import bisect
+import heapq
+import random
+from typing import Any, Iterable
+
+import numpy as np
+
+from snapshot import decode_strings, encode_strings
+from song_decision_tree import LEVEL_FEATURES
+from song_graph import SIMILARITY_WEIGHTING
+
+# The kinds of values stored in the nodes of a CompactDecisionTree, as recorded in its kinds array
+STRING_NODE, INT_NODE, FLOAT_NODE = 0, 1, 2
+# The max number of nodes scored by a search for the closest leaves by default
+TREE_SEARCH_BUDGET = 4096
+# The (weight, whether the difference is relative) of the feature of each level of the tree below the root,
+# as used by the similarity score
+_LEVEL_TERMS = tuple((SIMILARITY_WEIGHTING[feature_name], feature_name == "tempo") for feature_name in LEVEL_FEATURES)
+
+
+class CompactDecisionTree:
+    """
+    A read-only decision tree with each level containing values for a feature of the song's characteristics,
+    with the same find_related_songs method as SongDecisionTree.
+
+    The nodes are numbered from 0 in level order, starting with the root, so the subtrees of each node are the
+    consecutive nodes first_children[i] to first_children[i] + child_counts[i] - 1. The subtrees of a node are
+    sorted by their roots, with the numbers first and the strings after them. The root of node i is numbers[i]
+    if it is a number, and the string at index numbers[i] of the string table otherwise. The strings are stored
+    in the order of their nodes, so the string roots of the subtrees of a node are consecutive strings in
+    increasing order, and the leaves of the tree point into the same table to find their vertex ids.
+
+    Instance Attributes:
+        - kinds: Whether the root of each node is a string, int or float, as STRING_NODE, INT_NODE or FLOAT_NODE
+        - numbers: The root of each node that is a number, or the index of its string in the string table
+        - child_counts: The number of subtrees of each node
+        - first_children: The number of the first subtree of each node
+
+    Representation Invariants:
+        - len(self.kinds) == len(self.numbers) == len(self.child_counts) == len(self.first_children) > 0
+    """
+    kinds: np.ndarray
+    numbers: np.ndarray
+    child_counts: np.ndarray
+    first_children: np.ndarray
+    # Private Instance Attributes:
+    #   - _strings:
+    #       The string table, which holds the string roots of the nodes in order
+    #   - _kinds_view, _numbers_view, _child_counts_view, _first_children_view:
+    #       Memoryviews of kinds, numbers, child_counts and first_children, which are much faster to index
+    #       and search from Python
+    _strings: list[str]
+    _kinds_view: memoryview
+    _numbers_view: memoryview
+    _child_counts_view: memoryview
+    _first_children_view: memoryview
+
+    def __init__(self, arrays: dict[str, np.ndarray]) -> None:
+        """Initialize a tree from the given arrays, which were returned by CompactDecisionTree.to_arrays.
+
+        The arrays are used without being copied, so they may be memory-mapped from a snapshot file.
+        """
+        self.kinds = arrays['kinds']
+        self.numbers = arrays['numbers']
+        self.child_counts = arrays['child_counts']
+        self.first_children = np.concatenate(([1], 1 + np.cumsum(self.child_counts[:-1], dtype=np.int64)))
+        self._strings = decode_strings(arrays['strings'], int(np.count_nonzero(self.kinds == STRING_NODE)))
+        self._kinds_view = memoryview(np.ascontiguousarray(self.kinds))
+        self._numbers_view = memoryview(np.ascontiguousarray(self.numbers))
+        self._child_counts_view = memoryview(np.ascontiguousarray(self.child_counts))
+        self._first_children_view = memoryview(self.first_children)
+
+    @staticmethod
+    def from_songs(songs: Iterable[list], root: Any = '') -> CompactDecisionTree:
+        """Return the tree with the given root that SongDecisionTree(root, []) becomes after insert_song(items)
+        is called with each of the given lists of items, except that the subtrees of each node are sorted.
+
+        The tree is built one level at a time, by grouping the songs of each node by their item at that level.
+        """
+        kinds, numbers, child_counts, strings = [], [], [], []
+        level = [(root, list(songs))]
+        depth = 0
+        while level:
+            next_level = []
+            for value, node_songs in level:
+                if isinstance(value, str):
+                    kinds.append(STRING_NODE)
+                    numbers.append(len(strings))
+                    strings.append(value)
+                else:
+                    kinds.append(INT_NODE if isinstance(value, int) else FLOAT_NODE)
+                    numbers.append(value)
+
+                groups = {}
+                for song in node_songs:
+                    if len(song) > depth:
+                        if song[depth] not in groups:
+                            groups[song[depth]] = []
+                        groups[song[depth]].append(song)
+                child_counts.append(len(groups))
+                next_level.extend(sorted(groups.items(), key=lambda item: _root_order(item[0])))
+            level = next_level
+            depth += 1
+
+        return CompactDecisionTree({
+            'kinds': np.array(kinds, dtype=np.int8),
+            'numbers': np.array(numbers, dtype=np.float64),
+            'child_counts': np.array(child_counts, dtype=np.int32),
+            'strings': encode_strings(strings)
+        })
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Return this tree as a dictionary of typed arrays, which can be written to a snapshot file
+        and turned back into a tree with CompactDecisionTree(arrays).
+        """
+        return {
+            'kinds': self.kinds,
+            'numbers': self.numbers,
+            'child_counts': self.child_counts,
+            'strings': encode_strings(self._strings)
+        }
+
+    def _root(self, node: int) -> Any:
+        """Return the root of the given node."""
+        kind = self._kinds_view[node]
+        if kind == STRING_NODE:
+            return self._strings[int(self._numbers_view[node])]
+        return int(self._numbers_view[node]) if kind == INT_NODE else self._numbers_view[node]
+
+    def _find_subtree(self, node: int, value: Any) -> int:
+        """Return the subtree of the given node with value as its root, or otherwise the subtree whose root is
+        the number closest to value, choosing the smaller of two numbers that are equally close.
+        If no subtree has value or a number as its root, return a random subtree.
+
+        Preconditions:
+            - self.child_counts[node] > 0
+        """
+        start, split, stop = self._subtree_ranges(node)
+        if isinstance(value, str) and split < stop:
+            first_string = int(self._numbers_view[split])
+            i = bisect.bisect_left(self._strings, value, first_string, first_string + stop - split)
+            if i < first_string + stop - split and self._strings[i] == value:
+                return split + i - first_string
+        if split > start:
+            return self._closest_number(start, split, float(value))
+        return random.randint(start, stop - 1)
+
+    def _subtree_ranges(self, node: int) -> tuple[int, int, int]:
+        """Return (start, split, stop), where the subtrees of the given node whose roots are numbers are the nodes
+        start to split - 1, and the subtrees whose roots are strings are the nodes split to stop - 1.
+        """
+        start = self._first_children_view[node]
+        stop = start + self._child_counts_view[node]
+        if start == stop or self._kinds_view[start] == STRING_NODE:
+            return start, start, stop
+        elif self._kinds_view[stop - 1] != STRING_NODE:
+            return start, stop, stop
+        else:
+            split = bisect.bisect_left(self._kinds_view, True, start, stop, key=lambda kind: kind == STRING_NODE)
+            return start, split, stop
+
+    def _closest_number(self, start: int, stop: int, value: float) -> int:
+        """Return the node from start to stop - 1 whose root is the number closest to value, choosing the smaller
+        of two numbers that are equally close.
+
+        Preconditions:
+            - start < stop
+            - the roots of the nodes from start to stop - 1 are numbers in increasing order
+        """
+        i = bisect.bisect_left(self._numbers_view, value, start, stop)
+        if i == stop:
+            i -= 1
+        elif i > start and value - self._numbers_view[i - 1] <= self._numbers_view[i] - value:
+            i -= 1
+        return i
+
+    def find_related_songs(self, inputs: list) -> list:
+        """
+        Each input in the list is a value for a feature of the song's characteristics.
+        Traverse through the tree by going down the path with the closest value to the first input.
+        Return the leaf nodes when there are no more inputs.
+
+        The path is the same as SongDecisionTree.find_related_songs follows, and is found with a loop rather than
+        recursion. Each level is a binary search of the subtrees of a node, so it takes O(log k) time for k subtrees.
+        The leaves are returned in sorted order.
+
+        Preconditions:
+            - every node on the path has subtrees
+        """
+        node = 0
+        for value in inputs:
+            node = self._find_subtree(node, value)
+        start = self._first_children_view[node]
+        return [self._root(child) for child in range(start, start + self._child_counts_view[node])]
+
+    def find_closest_leaves(self, inputs: list, k: int, budget: int = TREE_SEARCH_BUDGET) -> list[tuple[Any, float]]:
+        """Return the k leaves whose paths are closest to the given inputs, each with the distance of its path,
+        in increasing order of distance.
+
+        Each input is a value for the feature of a level, in the order of LEVEL_FEATURES, and the leaves are the
+        subtrees of the nodes reached after the last input, as returned by find_related_songs. The distance of a path
+        is the sum of the terms of the similarity score between each input and the root of the node at its level,
+        weighted by SIMILARITY_WEIGHTING. Since every term is non-negative, the distance of a node's path is a lower
+        bound on the distance of every leaf below it.
+
+        The nodes are searched best-first, always expanding the node with the shortest path, so the leaves are found
+        in increasing order of distance and the nodes farther than the k-th leaf are never expanded. The subtrees
+        whose roots are numbers are sorted, and their distance only grows away from the input, so only the closest
+        one by distance is scored when a node is expanded, and the next one on either side is scored once the one
+        before it is expanded. The leaves returned are the closest ones as long as fewer than budget nodes are scored.
+        Once budget nodes have been scored, each remaining node is instead followed greedily down its closest subtrees,
+        as find_related_songs does, so the search never scores many more than budget nodes. The leaves found this way
+        may not be the closest ones.
+
+        Preconditions:
+            - len(inputs) <= len(LEVEL_FEATURES)
+            - k > 0
+            - budget >= 0
+        """
+        leaves = []
+        scored = 0
+        # A heap of the (distance, node, depth, siblings) of the nodes that have been scored but not expanded, where
+        # siblings is None if the node's siblings are not scored through it, and otherwise the (distance, start, split)
+        # of its parent and the side of the node whose next sibling is scored once it is expanded: -1 for smaller
+        # numbers, 1 for larger numbers or 0 for both
+        heap = [(0.0, 0, 0, None)]
+        while heap and len(leaves) < k:
+            distance, node, depth, siblings = heapq.heappop(heap)
+            if siblings is not None:
+                parent_distance, start, split, direction = siblings
+                for step in ((-1, 1) if direction == 0 else (direction,)):
+                    if start <= node + step < split:
+                        scored += 1
+                        heapq.heappush(heap, (parent_distance + self._level_distance(node + step, depth,
+                                                                                      inputs[depth - 1]),
+                                              node + step, depth, (parent_distance, start, split, step)))
+            if scored >= budget:
+                while depth < len(inputs) and self._child_counts_view[node] > 0:
+                    node, depth = self._find_subtree(node, inputs[depth]), depth + 1
+                    distance += self._level_distance(node, depth, inputs[depth - 1])
+            start, split, stop = self._subtree_ranges(node)
+            if depth == len(inputs):
+                leaves.extend((self._root(child), distance) for child in range(start, stop))
+                continue
+            for child in range(split, stop):
+                heapq.heappush(heap, (distance + self._level_distance(child, depth + 1, inputs[depth]),
+                                      child, depth + 1, None))
+            scored += stop - split
+            if split > start:
+                child = self._closest_level_child(start, split, depth + 1, inputs[depth])
+                heapq.heappush(heap, (distance + self._level_distance(child, depth + 1, inputs[depth]),
+                                      child, depth + 1, (distance, start, split, 0)))
+                scored += 1
+        leaves.sort(key=lambda leaf: leaf[1])
+        return leaves[:k]
+
+    def _closest_level_child(self, start: int, stop: int, depth: int, value: Any) -> int:
+        """Return the node from start to stop - 1 at the given depth whose root has the lowest _level_distance
+        to value, choosing the smaller of two numbers with the same distance.
+
+        The distance only grows away from value on either side, even when it is relative, so the closest node is
+        one of the two nodes around value. They are compared by their distance rather than their difference,
+        since a relative distance can make the farther number the closer one.
+
+        Preconditions:
+            - start < stop
+            - the roots of the nodes from start to stop - 1 are numbers in increasing order,
+                which are not negative if the distance at the given depth is relative
+        """
+        i = bisect.bisect_left(self._numbers_view, float(value), start, stop)
+        if i == stop:
+            return i - 1
+        elif i > start and self._level_distance(i - 1, depth, value) <= self._level_distance(i, depth, value):
+            return i - 1
+        return i
+
+    def _level_distance(self, node: int, depth: int, value: Any) -> float:
+        """Return the term of the similarity score between the given input and the root of the given node
+        at the given depth, where the root of the tree has depth 0.
+        """
+        weight, relative = _LEVEL_TERMS[depth - 1]
+        if self._kinds_view[node] == STRING_NODE:
+            return 0.0 if self._strings[int(self._numbers_view[node])] == value else weight
+        value, number = float(value), self._numbers_view[node]
+        if relative:
+            diff = abs(value - number) / max(value, number) if max(value, number) > 0 else 0
+        else:
+            diff = value - number
+        return weight * (diff * diff)
+
+
+def _root_order(value: Any) -> tuple[bool, float, str]:
+    """Return a key that sorts numbers in increasing order, followed by strings in increasing order."""
+    if isinstance(value, str):
+        return True, 0.0, value
+    return False, value, ''
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['bisect', 'heapq', 'random', 'numpy', 'snapshot', 'song_decision_tree', 'song_graph'],
+        'max-line-length': 120,
+    })
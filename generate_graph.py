@@ -2,10 +2,18 @@
 This module processes csv dataset files to generate the necessary objects to be used by the recommendation system
 """
 import csv
-from typing import Any
+import gc
+import hashlib
+import json
+from typing import Any, Optional
 
+import song_graph
+from compact_graph import CompactSongGraph
+from compact_tree import CompactDecisionTree
+from nn_descent import NN_DESCENT_ITERATIONS
+from snapshot import encode_strings, decode_strings, read_snapshot, write_snapshot
 from song_graph import SongGraph
-from song_decision_tree import SongDecisionTree, organize_levels, round_values
+from song_decision_tree import organize_levels, round_value_rows
 
 DATASET_NAME_1 = "datasets/kaggle_spotify_songs_1.csv"
 DATASET_NAME_2 = "datasets/kaggle_spotify_songs_2.csv"
@@ -20,6 +28,10 @@ SAME_GENRES = {"rap": "hip-hop", "r&b": "r-n-b", "hip hop": "hip-hop"}
 
 SEARCH_BAR_SPLITTER = "｜"
 
+SNAPSHOT_PATH = "datasets/song_graph.snapshot"
+# Increase this whenever the contents of a snapshot change, so old snapshots are rebuilt
+SNAPSHOT_VERSION = 5
+
 
 def filter_genre(genre: str) -> str:
     """
@@ -40,26 +52,29 @@ def add_to_objects(vertex_id: str, name: str, artists: set[str],
                    instrumentalness: str, liveness: str, valence: str,
                    tempo: str, genre: str,
                    songs_added: set,
-                   new_graph: SongGraph,
+                   new_vertices: list[tuple],
                    song_list_names: dict[str, str],
-                   new_tree: SongDecisionTree,
+                   tree_songs: list[list],
                    limit: int) -> str:
     """
-    Add a song to the graph and tree if it has not been added yet.
-    Also add it to the dictionary of song names and artists.
+    Add a song to the list of songs to insert into the tree and to the list of vertices to add to the graph
+    if it has not been added yet. Also add it to the dictionary of song names and artists.
+
+    The features of the songs in tree_songs are rounded all at once by generate_song_graph.
     """
     song_name = name + SEARCH_BAR_SPLITTER + artists
     if song_name.lower() not in songs_added:
-        artists = set(artists.split(";"))
+        # The artists are kept in the order of the dataset, without duplicates
+        artists = tuple(dict.fromkeys(artists.split(";")))
         genre = filter_genre(genre)
-        new_graph.add_vertex(
+        new_vertices.append((
             vertex_id, name, artists, danceability, energy, key, loudness, mode, speechiness, acousticness,
-            instrumentalness, liveness, valence, tempo, genre)
+            instrumentalness, liveness, valence, tempo, genre))
         songs_added.add(song_name.lower())
         song_list_names[song_name] = vertex_id
 
         if limit % INTERVAL == 0:
-            new_tree.insert_song(round_values(organize_levels({
+            tree_songs.append(organize_levels({
                 "danceability": float(danceability),
                 "energy": float(energy),
                 "key": int(key),
@@ -72,19 +87,40 @@ def add_to_objects(vertex_id: str, name: str, artists: set[str],
                 "liveness": float(liveness),
                 "tempo": float(tempo),
                 "genre": genre,
-            })) + [vertex_id])
+            }) + [vertex_id])
     return genre.capitalize()
 
 
-def generate_song_graph() -> tuple[SongGraph, dict[Any, Any], SongDecisionTree, set[str]]:
+def generate_song_graph(song_limit_1: int = SONG_LIMIT_1, song_limit_2: int = SONG_LIMIT_2, workers: int = 1,
+                        knn: Optional[int] = None, max_degree: Optional[int] = None, directed: bool = False) \
+        -> tuple[SongGraph, dict[Any, Any], CompactDecisionTree, set[str], dict[str, Any]]:
     """
-    Generates a SongGraph, dictionary mapping song and artists to track id, and SongDecisionTree
-    by reading two CSV datasets containing Spotify song data.
+    Generates a SongGraph, dictionary mapping song and artists to track id, and CompactDecisionTree
+    by reading two CSV datasets containing Spotify song data, along with the set of genres and the report
+    of the graph build returned by SongGraph.add_vertices, which records how long it took.
     Each song in the dataset is added as a vertex in the graph with its properties like
     genre, danceability, energy, tempo, artists, etc.
+
+    About song_limit_1 and song_limit_2 songs are sampled evenly from each dataset.
+    Pass FILE_LENGTH_1 and FILE_LENGTH_2 to load every song.
+    All the songs are added to the graph at once with SongGraph.add_vertices,
+    whose edges are scored in a pool of the given number of worker processes.
+    If max_degree is not None, each song only keeps its max_degree most similar edges, in both directions
+    unless directed is True (see SongGraph.generate_all_edges).
+    If knn is not None, the graph is instead an approximate knn-nearest neighbour graph,
+    built with SongGraph.generate_knn_edges.
+
+    Preconditions:
+        - 0 < song_limit_1 <= FILE_LENGTH_1
+        - 0 < song_limit_2 <= FILE_LENGTH_2
+        - workers > 0
+        - knn is None or knn > 0
+        - max_degree is None or max_degree > 0
+        - knn is None or max_degree is None
     """
     new_graph = SongGraph()
-    new_tree = SongDecisionTree('', [])
+    new_vertices = []
+    tree_songs = []
     song_list_names = {}
     songs_added = set()
     limit = 0
@@ -99,8 +135,8 @@ def generate_song_graph() -> tuple[SongGraph, dict[Any, Any], SongDecisionTree,
             row = reader[limit]
             genres.add(add_to_objects(row[1], row[4], row[2], row[8], row[9], row[10], row[11], row[12], row[13],
                                       row[14], row[15], row[16], row[17], row[18],
-                                      row[20], songs_added, new_graph, song_list_names, new_tree, limit))
-            limit += FILE_LENGTH_1 // SONG_LIMIT_1
+                                      row[20], songs_added, new_vertices, song_list_names, tree_songs, limit))
+            limit += FILE_LENGTH_1 // song_limit_1
             total += 1
 
     limit = 0
@@ -114,19 +150,127 @@ def generate_song_graph() -> tuple[SongGraph, dict[Any, Any], SongDecisionTree,
             genres.add(add_to_objects(
                 row[0], row[1], row[2], row[11], row[12], row[13],
                 row[14], row[15], row[16], row[17], row[18], row[19],
-                row[20], row[21], row[9], songs_added, new_graph, song_list_names, new_tree, limit
+                row[20], row[21], row[9], songs_added, new_vertices, song_list_names, tree_songs, limit
             ))
-            limit += FILE_LENGTH_2 // SONG_LIMIT_2
+            limit += FILE_LENGTH_2 // song_limit_2
             total += 1
 
+    report = new_graph.add_vertices(new_vertices, workers, knn, max_degree, directed)
+    rounded_songs = round_value_rows([song[:-1] for song in tree_songs])
+    new_tree = CompactDecisionTree.from_songs(rounded + [song[-1]] for rounded, song in zip(rounded_songs, tree_songs))
+    return new_graph, song_list_names, new_tree, genres, report
+
+
+def snapshot_fingerprint(song_limit_1: int = SONG_LIMIT_1, song_limit_2: int = SONG_LIMIT_2,
+                         knn: Optional[int] = None, max_degree: Optional[int] = None, directed: bool = False) -> str:
+    """
+    Return a fingerprint of everything that the objects returned by generate_song_graph depend on:
+    the contents of the datasets, the similarity weights and score limit, the kind of graph built,
+    and the constants used to sample and filter the songs.
+    A snapshot is only loaded if it was saved with the same fingerprint.
+    """
+    fingerprint = hashlib.sha256()
+    for dataset_name in (DATASET_NAME_1, DATASET_NAME_2):
+        with open(dataset_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                fingerprint.update(chunk)
+    fingerprint.update(json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'weighting': song_graph.SIMILARITY_WEIGHTING,
+        'score_limit': song_graph.SCORE_LIMIT,
+        'file_lengths': [FILE_LENGTH_1, FILE_LENGTH_2],
+        'song_limits': [song_limit_1, song_limit_2],
+        'knn': [knn, NN_DESCENT_ITERATIONS],
+        'max_degree': [max_degree, directed],
+        'interval': INTERVAL,
+        'base_genres': sorted(BASE_GENRES),
+        'same_genres': SAME_GENRES
+    }, sort_keys=True).encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def save_snapshot(path: str, fingerprint: str, new_graph: SongGraph, song_list_names: dict[str, str],
+                  new_tree: CompactDecisionTree, genres: set[str]) -> None:
+    """
+    Save the objects returned by generate_song_graph, except for the report of the build,
+    to a snapshot file at path, with the given fingerprint.
+    """
+    arrays = {'graph_' + name: array for name, array in new_graph.to_arrays().items()}
+    arrays.update({'tree_' + name: array for name, array in new_tree.to_arrays().items()})
+    arrays['song_names'] = encode_strings(list(song_list_names))
+    arrays['song_vertex_ids'] = encode_strings(list(song_list_names.values()))
+    arrays['genres'] = encode_strings(sorted(genres))
+    write_snapshot(path, fingerprint, arrays, {'song_count': len(song_list_names), 'genre_count': len(genres)})
+
+
+def load_snapshot(path: str, fingerprint: str, mmap_graph: bool = False) \
+        -> tuple[SongGraph | CompactSongGraph, dict[Any, Any], CompactDecisionTree, set[str]]:
+    """
+    Load the objects returned by generate_song_graph from the snapshot file at path.
+
+    If mmap_graph is True, the graph is loaded as a read-only CompactSongGraph whose arrays are memory-mapped
+    from the snapshot file, so that every process serving recommendations shares one copy of the graph.
+
+    Raise a ValueError if the file is not a snapshot or was saved with a different fingerprint.
+    """
+    arrays, metadata = read_snapshot(path, fingerprint, mmap_graph)
+    graph_arrays = {name[len('graph_'):]: array for name, array in arrays.items() if name.startswith('graph_')}
+    # None of the objects created while loading can be garbage, so the garbage collector is paused
+    # rather than repeatedly scanning them
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        new_graph = CompactSongGraph(graph_arrays) if mmap_graph else SongGraph.from_arrays(graph_arrays)
+        new_tree = CompactDecisionTree({name[len('tree_'):]: array for name, array in arrays.items()
+                                        if name.startswith('tree_')})
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    song_list_names = dict(zip(decode_strings(arrays['song_names'], metadata['song_count']),
+                               decode_strings(arrays['song_vertex_ids'], metadata['song_count'])))
+    genres = set(decode_strings(arrays['genres'], metadata['genre_count']))
     return new_graph, song_list_names, new_tree, genres
 
 
+def load_song_graph(snapshot_path: Optional[str] = SNAPSHOT_PATH, song_limit_1: int = SONG_LIMIT_1,
+                    song_limit_2: int = SONG_LIMIT_2, workers: int = 1, mmap_graph: bool = False,
+                    knn: Optional[int] = None, max_degree: Optional[int] = None, directed: bool = False) \
+        -> tuple[SongGraph | CompactSongGraph, dict[Any, Any], CompactDecisionTree, set[str], Optional[dict[str, Any]]]:
+    """
+    Return the same objects as generate_song_graph(song_limit_1, song_limit_2, workers, knn, max_degree, directed),
+    loading them from the snapshot at snapshot_path if it is up to date, in which case the report is None
+    since the graph was not built.
+    Otherwise, generate them and save a new snapshot to snapshot_path.
+    If snapshot_path is None, always generate the objects without saving them.
+
+    If mmap_graph is True and a snapshot is available, the graph is a read-only CompactSongGraph
+    memory-mapped from the snapshot, as described in load_snapshot.
+    """
+    if snapshot_path is None:
+        return generate_song_graph(song_limit_1, song_limit_2, workers, knn, max_degree, directed)
+
+    fingerprint = snapshot_fingerprint(song_limit_1, song_limit_2, knn, max_degree, directed)
+    try:
+        return *load_snapshot(snapshot_path, fingerprint, mmap_graph), None
+    except (OSError, ValueError, KeyError):
+        pass
+
+    objects = generate_song_graph(song_limit_1, song_limit_2, workers, knn, max_degree, directed)
+    try:
+        save_snapshot(snapshot_path, fingerprint, *objects[:4])
+    except OSError:
+        return objects
+    if mmap_graph:
+        return CompactSongGraph.from_snapshot(snapshot_path, fingerprint), *objects[1:]
+    return objects
+
+
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['csv', 'song_graph', 'song_decision_tree'],
-        'allowed-io': ['generate_song_graph'],
+        'extra-imports': ['csv', 'gc', 'hashlib', 'json', 'compact_graph', 'compact_tree', 'nn_descent', 'snapshot',
+                          'song_graph', 'song_decision_tree'],
+        'allowed-io': ['generate_song_graph', 'snapshot_fingerprint'],
         'max-line-length': 120,
     })
@@ -0,0 +1,179 @@
+"""
+A module that builds approximate k-nearest neighbour graphs with NN-Descent (Dong, Charikar and Li, 2011).
+
+NN-Descent starts from a random neighbour list for every point and repeatedly improves it with local joins:
+the neighbours of a neighbour of a point are likely to be neighbours of that point too, so every pair of points
+that share a neighbour is compared, and each point keeps the k closest points it has seen. Only the pairs involving
+a neighbour that is new since the last iteration are compared, so each iteration does less work than the one before.
+
+The work of each iteration is done in chunks of points with numpy, so the memory it uses is bounded by
+the chunk size rather than by the number of pairs compared.
+"""
+from __future__ import annotations
+
+from typing import Callable
+
+import numpy as np
+
+# The number of iterations of local joins done by default
+NN_DESCENT_ITERATIONS = 10
+# The fraction of the new neighbours of each point that take part in each local join
+NN_DESCENT_SAMPLE_RATE = 0.5
+# NN-Descent stops early once an iteration changes fewer than this fraction of the n * k neighbours
+NN_DESCENT_DELTA = 0.001
+# The number of points whose local joins are scored at once
+NN_DESCENT_CHUNK_SIZE = 4096
+
+
+def nn_descent(count: int, score_pairs: Callable[[np.ndarray, np.ndarray], np.ndarray], k: int,
+               iterations: int = NN_DESCENT_ITERATIONS, seed: int = 0,
+               sample_rate: float = NN_DESCENT_SAMPLE_RATE, delta: float = NN_DESCENT_DELTA,
+               chunk_size: int = NN_DESCENT_CHUNK_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """Return an approximate list of the k nearest neighbours of each of count points numbered 0 to count - 1,
+    as a (count, k) array of point numbers and a (count, k) array of their distances.
+
+    score_pairs(rows, columns) must return the distance between point rows[i] and point columns[i] for every i,
+    where a smaller distance means a closer point. Each row of the result is sorted by distance, closest first.
+    A row with fewer than k neighbours, which only happens if count <= k, is padded with -1 and an infinite distance.
+
+    At most iterations rounds of local joins are done, stopping early once a round changes fewer than
+    delta * count * k neighbours. The result only depends on the inputs, including seed.
+
+    Preconditions:
+        - count >= 0
+        - k > 0
+        - iterations >= 0
+        - 0 < sample_rate <= 1
+        - chunk_size > 0
+    """
+    rng = np.random.default_rng(seed)
+    neighbours = np.full((count, k), -1, dtype=np.int64)
+    distances = np.full((count, k), np.inf)
+    is_new = np.zeros((count, k), dtype=bool)
+    if count < 2:
+        return neighbours, distances
+
+    # Start from k random neighbours for each point, never the point itself
+    points = np.repeat(np.arange(count), k)
+    others = rng.integers(0, count - 1, size=count * k)
+    others += others >= points
+    _merge(neighbours, distances, is_new, points, others, score_pairs(points, others))
+
+    max_candidates = max(1, int(np.ceil(sample_rate * k)))
+    for _ in range(iterations):
+        new_lists, old_lists = _candidate_lists(neighbours, is_new, max_candidates, rng)
+        updates = 0
+        for start in range(0, count, chunk_size):
+            rows, columns = _local_join_pairs(new_lists[start:start + chunk_size], old_lists[start:start + chunk_size])
+            scores = score_pairs(rows, columns)
+            updates += _merge(neighbours, distances, is_new, np.concatenate((rows, columns)),
+                              np.concatenate((columns, rows)), np.concatenate((scores, scores)))
+        if updates < delta * count * k:
+            break
+    return neighbours, distances
+
+
+def _merge(neighbours: np.ndarray, distances: np.ndarray, is_new: np.ndarray,
+           rows: np.ndarray, columns: np.ndarray,
+           scores: np.ndarray) -> int:
+    """Offer point columns[i] at distance scores[i] as a neighbour of point rows[i], for every i,
+    and return the number of neighbours that changed.
+
+    Each point keeps the k closest of its current neighbours and the points offered to it, without repeats.
+    A point offered at the same distance as the current farthest neighbour does not replace it, and other ties
+    are broken by point number. The neighbours that were offered and kept are flagged as new.
+    The given neighbours, distances and new flags are updated in place, and only the rows of the points
+    that are offered a closer point are rebuilt.
+    """
+    k = neighbours.shape[1]
+    closer = np.flatnonzero(scores < distances[rows, -1])
+    rows, columns, scores = rows[closer], columns[closer], scores[closer]
+    affected = np.unique(rows)
+    if len(affected) == 0:
+        return 0
+
+    # Number the affected rows from 0 and put their current neighbours before the offered points
+    current = neighbours[affected] >= 0
+    all_rows = np.concatenate((np.repeat(np.arange(len(affected)), k)[current.ravel()],
+                               np.searchsorted(affected, rows)))
+    all_columns = np.concatenate((neighbours[affected][current], columns))
+    all_scores = np.concatenate((distances[affected][current], scores))
+    all_new = np.concatenate((is_new[affected][current], np.ones(len(rows), dtype=bool)))
+    offered = np.arange(len(all_rows)) >= int(current.sum())
+
+    # Drop repeated (row, column) pairs, keeping the current neighbour since it comes first
+    order = np.argsort(all_rows * len(neighbours) + all_columns, kind='stable')
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (all_rows[order][1:] != all_rows[order][:-1]) | (all_columns[order][1:] != all_columns[order][:-1])
+    order = order[first]
+
+    # Keep the k closest of each row, the sort being stable so that ties stay ordered by column
+    order = order[np.lexsort((all_scores[order], all_rows[order]))]
+    kept_rows = all_rows[order]
+    ranks = np.arange(len(order)) - np.searchsorted(kept_rows, np.arange(len(affected)))[kept_rows]
+    order, kept_rows, ranks = order[ranks < k], kept_rows[ranks < k], ranks[ranks < k]
+
+    neighbours[affected] = -1
+    distances[affected] = np.inf
+    is_new[affected] = False
+    neighbours[affected[kept_rows], ranks] = all_columns[order]
+    distances[affected[kept_rows], ranks] = all_scores[order]
+    is_new[affected[kept_rows], ranks] = all_new[order]
+    return int(offered[order].sum())
+
+
+def _candidate_lists(neighbours: np.ndarray, is_new: np.ndarray, max_candidates: int,
+                     rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Return the new and old candidate lists of each point for a round of local joins, as (count, max_candidates)
+    arrays of point numbers padded with -1, and mark the new neighbours that were sampled as old.
+
+    The candidates of a point are its neighbours and the points that have it as a neighbour (its reverse neighbours).
+    At most max_candidates new and max_candidates old candidates are sampled at random for each point.
+    """
+    count, k = neighbours.shape
+    valid = neighbours >= 0
+    points = np.repeat(np.arange(count), k).reshape(count, k)
+    owners = np.concatenate((points[valid], neighbours[valid]))
+    members = np.concatenate((neighbours[valid], points[valid]))
+    new = np.concatenate((is_new[valid], is_new[valid]))
+    sources = np.concatenate((np.flatnonzero(valid.ravel()), np.flatnonzero(valid.ravel())))
+
+    new_lists, new_sources = _sample_lists(owners[new], members[new], sources[new], count, max_candidates, rng)
+    old_lists, _ = _sample_lists(owners[~new], members[~new], sources[~new], count, max_candidates, rng)
+    is_new.ravel()[new_sources] = False
+    return new_lists, old_lists
+
+
+def _sample_lists(owners: np.ndarray, members: np.ndarray, sources: np.ndarray, count: int, size: int,
+                  rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Return a (count, size) array whose i-th row holds up to size of the distinct members[j] with owners[j] == i,
+    chosen at random and padded with -1, and the sources[j] of the chosen entries.
+    """
+    _, order = np.unique(owners * count + members, return_index=True)
+    order = order[np.argsort(owners[order] + rng.random(len(order)))]
+
+    sorted_owners = owners[order]
+    ranks = np.arange(len(order)) - np.searchsorted(sorted_owners, np.arange(count))[sorted_owners]
+    order, sorted_owners, ranks = order[ranks < size], sorted_owners[ranks < size], ranks[ranks < size]
+    lists = np.full((count, size), -1, dtype=np.int64)
+    lists[sorted_owners, ranks] = members[order]
+    return lists, sources[order]
+
+
+def _local_join_pairs(new_lists: np.ndarray, old_lists: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the pairs of points compared by the local joins of the points with the given candidate lists,
+    as two parallel arrays: every pair of new candidates, and every new candidate with every old candidate.
+    """
+    first, second = np.triu_indices(new_lists.shape[1], 1)
+    rows = np.concatenate((new_lists[:, first].ravel(), np.repeat(new_lists, old_lists.shape[1], axis=1).ravel()))
+    columns = np.concatenate((new_lists[:, second].ravel(), np.tile(old_lists, new_lists.shape[1]).ravel()))
+    valid = (rows >= 0) & (columns >= 0) & (rows != columns)
+    return rows[valid], columns[valid]
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['numpy'],
+        'max-line-length': 120,
+    })
@@ -0,0 +1,444 @@
+"""
+This module contains the RecommendationServer class, an asyncio server that loads a RecommendationSystem once
+and answers song searches and recommendations for many clients at once over a JSON line protocol.
+
+Each request is a line holding a JSON object {"id": ..., "method": ..., "params": {...}}, and is answered by a line
+holding {"id": ..., "result": ...} or {"id": ..., "error": ...}. The requests of a connection are answered as soon as
+each one is done, so the answers may come back in a different order than the requests. The methods are:
+    - "search": the song names containing params["text"], ignoring case, like the search bar of the GUI
+    - "recommend": generate_recommendations(params["songs"], params["n"]) for a list of song names
+    - "recommend_features": generate_recommendations(params["features"], params["n"]) for a list of features
+        in the order of organize_levels, or a dictionary of features
+    - "metrics": the number of requests and their latencies for each method, and the search cache statistics
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from recommendation_system import DEFAULT_RECOMMENDATION_COUNT, RecommendationSystem
+from song_decision_tree import organize_levels
+
+# The port the server listens on by default
+DEFAULT_PORT = 8765
+# The number of threads that run the searches and recommendations by default
+SERVER_WORKERS = 4
+# The seconds a request waits for other requests to be run in the same batch
+BATCH_WINDOW = 0.002
+# The max number of requests run in one batch
+MAX_BATCH_SIZE = 32
+# The max number of song names returned by a search by default
+SEARCH_LIMIT = 50
+# The number of most recent latencies of each method that the percentiles are computed from
+LATENCY_WINDOW = 10000
+
+
+class LatencyMetrics:
+    """The number of requests answered for each method and the latencies of the most recent ones.
+
+    Instance Attributes:
+        - window: The number of most recent latencies of each method that are kept
+
+    Representation Invariants:
+        - self.window > 0
+    """
+    window: int
+    # Private Instance Attributes:
+    #   - _counts:
+    #       A dictionary mapping each method to the number of requests answered and the number of errors
+    #   - _totals:
+    #       A dictionary mapping each method to the sum of the seconds taken by all its requests
+    #   - _latencies:
+    #       A dictionary mapping each method to the seconds taken by its most recent requests
+    _counts: dict[str, list[int]]
+    _totals: dict[str, float]
+    _latencies: dict[str, deque[float]]
+
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        """Initialize metrics with no requests, keeping the given number of latencies for each method.
+
+        Preconditions:
+            - window > 0
+        """
+        self.window = window
+        self._counts = {}
+        self._totals = {}
+        self._latencies = {}
+
+    def record(self, method: str, seconds: float, error: bool = False) -> None:
+        """Record a request for the given method that was answered in the given number of seconds."""
+        if method not in self._counts:
+            self._counts[method] = [0, 0]
+            self._totals[method] = 0.0
+            self._latencies[method] = deque(maxlen=self.window)
+        self._counts[method][0] += 1
+        self._counts[method][1] += error
+        self._totals[method] += seconds
+        self._latencies[method].append(seconds)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Return a dictionary mapping each method to its number of requests and errors, and the mean,
+        median (p50) and 99th percentile (p99) of its latencies in milliseconds.
+
+        The percentiles are computed from the most recent window latencies of each method.
+        """
+        summary = {}
+        for method, (count, errors) in self._counts.items():
+            latencies = sorted(self._latencies[method])
+            summary[method] = {
+                'count': count,
+                'errors': errors,
+                'mean_ms': self._totals[method] / count * 1000,
+                'p50_ms': _percentile(latencies, 0.5) * 1000,
+                'p99_ms': _percentile(latencies, 0.99) * 1000
+            }
+        return summary
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of the given sorted values.
+
+    Preconditions:
+        - values != []
+        - 0 < fraction <= 1
+    """
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class RecommendationServer:
+    """An asyncio server answering requests to a RecommendationSystem over a JSON line protocol.
+
+    The searches and recommendations run in a pool of threads, so the event loop keeps reading and answering
+    requests while they run. The requests that arrive within batch_window seconds of each other are run together
+    in one call to the pool, and identical requests in a batch are only run once.
+
+    Instance Attributes:
+        - system: The recommendation system answering the requests
+        - host: The host the server listens on
+        - port: The port the server listens on, which is chosen by the system if it was 0 when started
+        - batch_window: The seconds a request waits for other requests to be run in the same batch
+        - max_batch_size: The max number of requests run in one batch
+        - metrics: The latencies of the requests answered by this server
+
+    Representation Invariants:
+        - self.batch_window >= 0
+        - self.max_batch_size > 0
+    """
+    system: RecommendationSystem
+    host: str
+    port: int
+    batch_window: float
+    max_batch_size: int
+    metrics: LatencyMetrics
+    # Private Instance Attributes:
+    #   - _song_names:
+    #       The names of all the songs in the system, each paired with its lowercase version
+    #   - _executor:
+    #       The pool of threads that run the batches
+    #   - _server:
+    #       The asyncio server, or None if it is not started
+    #   - _queue:
+    #       The requests waiting to be run, each as a method, its parameters and the future of its result
+    #   - _batcher:
+    #       The task collecting the requests in _queue into batches
+    #   - _batch_tasks:
+    #       The tasks running the batches that are not done, which are kept so they are not garbage collected
+    #   - _batch_sizes:
+    #       The number of batches run and the number of requests in them
+    _song_names: list[tuple[str, str]]
+    _executor: ThreadPoolExecutor
+    _server: Optional[asyncio.base_events.Server]
+    _queue: Optional[asyncio.Queue]
+    _batcher: Optional[asyncio.Task]
+    _batch_tasks: set[asyncio.Task]
+    _batch_sizes: list[int]
+
+    def __init__(self, system: RecommendationSystem, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                 workers: int = SERVER_WORKERS, batch_window: float = BATCH_WINDOW,
+                 max_batch_size: int = MAX_BATCH_SIZE) -> None:
+        """Initialize a server for the given recommendation system, which is started by RecommendationServer.start.
+
+        Preconditions:
+            - workers > 0
+            - batch_window >= 0
+            - max_batch_size > 0
+        """
+        self.system = system
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.metrics = LatencyMetrics()
+        self._song_names = [(name, name.lower()) for name in system.song_list_names]
+        self._executor = ThreadPoolExecutor(workers)
+        self._server = None
+        self._queue = None
+        self._batcher = None
+        self._batch_tasks = set()
+        self._batch_sizes = [0, 0]
+
+    async def start(self) -> None:
+        """Start listening for connections on host and port."""
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._collect_batches())
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        """Start this server if it is not started, and answer requests until it is closed."""
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        """Stop listening for connections and stop the pool of threads."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        for task in self._batch_tasks:
+            task.cancel()
+        self._executor.shutdown()
+
+    async def __aenter__(self) -> RecommendationServer:
+        """Start this server, which is closed at the end of the async with statement."""
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """Close this server."""
+        await self.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer each request read from a connection as soon as it is done, until the client closes it."""
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.create_task(self._answer(line, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _answer(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        """Run the request in the given line and write its answer to the connection."""
+        start = time.perf_counter()
+        method = 'invalid'
+        response = {'id': None}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request must be a JSON object')
+            response['id'] = request.get('id')
+            method = str(request.get('method'))
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise ValueError('params must be a JSON object')
+            response['result'] = await self.request(method, params)
+        except Exception as error:
+            # Any error raised by a request is answered, so it never stops the other requests from being answered
+            response['error'] = f'{type(error).__name__}: {error}'
+
+        if method not in _METHODS and method != 'metrics':
+            method = 'invalid'
+        self.metrics.record(method, time.perf_counter() - start, 'error' in response)
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def request(self, method: str, params: dict[str, Any]) -> Any:
+        """Return the result of the given method with the given parameters.
+
+        Raise a ValueError if the method does not exist, and the error raised by the method
+        if the parameters are not valid for it.
+        """
+        if method == 'metrics':
+            return self.get_metrics()
+        if method not in _METHODS:
+            raise ValueError(f'unknown method {method!r}')
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((method, json.dumps(params, sort_keys=True), future))
+        return await future
+
+    def get_metrics(self) -> dict[str, Any]:
+        """Return the latencies of each method, the number and mean size of the batches run,
+        and the statistics of the search cache of the graph.
+        """
+        batches, requests = self._batch_sizes
+        return {
+            'methods': self.metrics.summary(),
+            'batches': batches,
+            'mean_batch_size': requests / batches if batches > 0 else 0.0,
+            'search_cache': self.system.graph.search_cache.info()
+        }
+
+    async def _collect_batches(self) -> None:
+        """Repeatedly wait for a request, collect the requests that arrive within batch_window seconds of it,
+        up to max_batch_size, and start running them in the pool of threads.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._batch_sizes[0] += 1
+            self._batch_sizes[1] += len(batch)
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[str, str, asyncio.Future]]) -> None:
+        """Run the given batch of requests in the pool of threads, and set the future of each request
+        to its result.
+        """
+        requests = list(dict.fromkeys((method, params) for method, params, _ in batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self._run_requests, requests)
+        except Exception as error:
+            results = {request: (False, error) for request in requests}
+        for method, params, future in batch:
+            if not future.done():
+                succeeded, result = results[(method, params)]
+                if succeeded:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+
+    def _run_requests(self, requests: list[tuple[str, str]]) -> dict[tuple[str, str], tuple[bool, Any]]:
+        """Return a dictionary mapping each of the given requests to whether it succeeded and its result,
+        or the error it raised. An error raised by one request does not stop the others from being run.
+        """
+        results = {}
+        for method, params in requests:
+            try:
+                results[(method, params)] = (True, _METHODS[method](self, json.loads(params)))
+            except Exception as error:
+                results[(method, params)] = (False, error)
+        return results
+
+    def search(self, params: dict[str, Any]) -> list[str]:
+        """Return up to params["limit"] of the song names containing params["text"], ignoring case."""
+        text = str(params['text']).lower()
+        limit = int(params.get('limit', SEARCH_LIMIT))
+        matches = []
+        for name, lowercase_name in self._song_names:
+            if len(matches) >= limit:
+                break
+            if text in lowercase_name:
+                matches.append(name)
+        return matches
+
+    def recommend(self, params: dict[str, Any]) -> list[list[tuple[str, str, float]]]:
+        """Return the recommendations for the list of song names params["songs"], which must be song names
+        returned by a search.
+        """
+        songs = params['songs']
+        if not isinstance(songs, list) or not all(isinstance(song, str) for song in songs):
+            raise TypeError('songs must be a list of song names')
+        for song in songs:
+            if song not in self.system.song_list_names:
+                raise KeyError(f'unknown song {song!r}')
+        return self.system.generate_recommendations(songs, _recommendation_count(params))
+
+    def recommend_features(self, params: dict[str, Any]) -> list[list[tuple[str, str, float]]]:
+        """Return the recommendations for the song with the features params["features"], which is either a list
+        in the order of organize_levels or a dictionary accepted by organize_levels.
+        """
+        features = params['features']
+        if isinstance(features, dict):
+            features = organize_levels(features)
+        if not isinstance(features, list) or len(features) != len(organize_levels({})):
+            raise ValueError('features must have a genre and a value for every feature')
+        features = [str(features[0]).lower()] + [float(value) for value in features[1:]]
+        return self.system.generate_recommendations(features, _recommendation_count(params))
+
+
+def _recommendation_count(params: dict[str, Any]) -> int:
+    """Return the number of recommendations requested by the given parameters."""
+    n = int(params.get('n', DEFAULT_RECOMMENDATION_COUNT))
+    if n <= 0:
+        raise ValueError('n must be positive')
+    return n
+
+
+# The methods run in the pool of threads, by name
+_METHODS: dict[str, Callable[[RecommendationServer, dict[str, Any]], Any]] = {
+    'search': RecommendationServer.search,
+    'recommend': RecommendationServer.recommend,
+    'recommend_features': RecommendationServer.recommend_features
+}
+
+
+async def send_request(host: str, port: int, method: str, params: Optional[dict[str, Any]] = None) -> Any:
+    """Open a connection to the server at host and port, send it a request for the given method and parameters,
+    and return its result.
+
+    Raise a ValueError with the error message of the server if the request failed.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(json.dumps({'id': 0, 'method': method, 'params': params or {}}).encode('utf-8') + b'\n')
+        await writer.drain()
+        response = json.loads(await reader.readline())
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return response['result']
+
+
+def run_server(host: str = '127.0.0.1', port: int = DEFAULT_PORT, workers: int = SERVER_WORKERS,
+               **options: Any) -> None:
+    """Load a RecommendationSystem(**options) and answer requests to it at host and port until interrupted.
+
+    Preconditions:
+        - workers > 0
+        - options are keyword arguments of RecommendationSystem
+    """
+    server = RecommendationServer(RecommendationSystem(**options), host, port, workers)
+
+    async def serve() -> None:
+        """Answer requests until the server is closed."""
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['asyncio', 'json', 'math', 'time', 'collections', 'concurrent.futures',
+                          'recommendation_system', 'song_decision_tree'],
+        'max-line-length': 120,
+    })
@@ -2,11 +2,15 @@
 This module contains the RecommendationSystem class, which generates song recommendations
 based on inputs given by the user
 """
-import random
-from typing import Optional
-from generate_graph import generate_song_graph
-from song_graph import SongGraph
-from song_decision_tree import SongDecisionTree
+import heapq
+from typing import Any, Iterator, Optional
+from generate_graph import SNAPSHOT_PATH, load_song_graph
+from compact_graph import CompactSongGraph
+from compact_tree import CompactDecisionTree
+from recommendation_table import RECOMMENDATION_TABLE_SIZE, RecommendationTable, load_recommendation_table
+from search_cache import SEARCH_CACHE_SIZE
+from song_graph import NUMERICAL_FEATURES, SongGraph
+from song_decision_tree import LEVEL_FEATURES
 
 DEFAULT_RECOMMENDATION_COUNT = 10
 
@@ -16,50 +20,138 @@ class RecommendationSystem:
     Song recommendation system class to generate recommendations.
 
     Instance Attributes:
-        - graph: SongGraph object that contains the song graph
+        - graph: SongGraph or read-only CompactSongGraph object that contains the song graph
         - song_list_names: a dictionary mapping song names to its vertex id in graph
-        - tree: SongDecisionTree object that contains the decision tree
+        - tree: read-only CompactDecisionTree object that contains the decision tree
         - genres: a list of all the genres in graph
+        - table: the precomputed RecommendationTable of graph, or None if there is none
+        - build_report: the report of the build of graph returned by SongGraph.add_vertices, with the seconds
+            spent adding the songs and generating the edges, or None if graph was loaded from a snapshot
+        - tree_search: whether the recommendations for a list of features are searched for in graph from
+            the closest song in tree, rather than found by find_closest_songs
     """
-    graph: SongGraph
+    graph: SongGraph | CompactSongGraph
     song_list_names: dict[str, str]
-    tree: SongDecisionTree
+    tree: CompactDecisionTree
     genres: list[str]
+    table: Optional[RecommendationTable]
+    build_report: Optional[dict[str, Any]]
+    tree_search: bool
 
-    def __init__(self) -> None:
+    def __init__(self, snapshot_path: Optional[str] = SNAPSHOT_PATH, mmap_graph: bool = False,
+                 compact: bool = False, knn: Optional[int] = None, max_degree: Optional[int] = None,
+                 cache_size: int = SEARCH_CACHE_SIZE, table_path: Optional[str] = None,
+                 table_size: int = RECOMMENDATION_TABLE_SIZE, workers: int = 1, tree_search: bool = False) -> None:
         """
         Initialize the RecommendationSystem class and generate the song graph.
+
+        The song graph and decision tree are loaded from the snapshot at snapshot_path if it is up to date,
+        and are otherwise generated from the datasets and saved there. If snapshot_path is None,
+        they are always generated from the datasets.
+
+        If mmap_graph is True, the song graph is memory-mapped read-only from the snapshot, so that several
+        worker processes share one copy of it. If compact is True, the song graph is frozen into a CompactSongGraph,
+        which stores its edges in arrays rather than a dictionary per vertex.
+
+        If knn is not None, the song graph joins each song to its knn most similar songs, rather than to every song
+        with a similarity score less than SCORE_LIMIT. See SongGraph.generate_knn_edges.
+        Otherwise, if max_degree is not None, each song only keeps its max_degree most similar edges.
+        See SongGraph.generate_all_edges.
+
+        The results of the searches from the last cache_size songs used are cached in the search_cache of the graph.
+
+        If table_path is not None, the table_size closest songs to every song are looked up in a RecommendationTable
+        instead of being searched for. The table is loaded from table_path if it was computed from the same graph,
+        and is otherwise computed and saved there. The graph and the table are computed with the given number of
+        worker processes.
+
+        If tree_search is True, the recommendations for a list of features are the songs closest in the graph to
+        the closest song in the decision tree, which is found by obtain_vertex_id. Otherwise, they are the songs
+        with the closest features in the graph, which are found by find_closest_songs.
         """
-        self.graph, self.song_list_names, self.tree, self.genres = generate_song_graph()
+        self.tree_search = tree_search
+        self.graph, self.song_list_names, self.tree, self.genres, self.build_report = load_song_graph(
+            snapshot_path, workers=workers, mmap_graph=mmap_graph, knn=knn, max_degree=max_degree)
+        if compact and isinstance(self.graph, SongGraph):
+            self.graph = CompactSongGraph.from_graph(self.graph)
+        self.graph.search_cache.resize(cache_size)
+        if table_path is None:
+            self.table = None
+        else:
+            self.table = load_recommendation_table(table_path, self.graph, table_size, workers)
 
     def obtain_vertex_id(self, given_input: Optional[str | list]) -> Optional[str]:
         """
         If given a string formatted like "song_name<SEARCH_BAR_SPLITTER>artist_name", return the vertex_id of the song.
         If given a list of inputs, return the vertex_id of the song that is closest to the inputs.
+
+        The closest song to a list of inputs is the closest leaf of the decision tree, which is found with a
+        best-first search of the tree. See CompactDecisionTree.find_closest_leaves.
         """
         if given_input is None:
             return None
         if isinstance(given_input, str):
             return self.song_list_names[given_input]
         else:
-            options = self.tree.find_related_songs(given_input)
-            return options[random.randint(0, len(options) - 1)]
+            leaves = self.tree.find_closest_leaves(given_input, 1)
+            return leaves[0][0] if leaves else None
+
+    def find_shortest_distances(self, vertex_ids: list[str], n: int) -> list[list[tuple[str, float]]]:
+        """Return graph.find_shortest_distance(vertex_id, n) for each of the given vertex ids.
 
-    def get_similarity_score_count(self, vertex_ids: list[str], n: int) -> dict[tuple[str, str], list[float]]:
+        The results are looked up in the recommendation table if there is one,
+        and the ones that are not in it are searched for with graph.find_shortest_distances.
+        """
+        if self.table is None:
+            return self.graph.find_shortest_distances(vertex_ids, n)
+        results = [self.table.find_shortest_distance(vertex_id, n) for vertex_id in vertex_ids]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            for i, result in zip(missing, self.graph.find_shortest_distances([vertex_ids[i] for i in missing], n)):
+                results[i] = result
+        return results
+
+    def find_closest_songs(self, features: list, n: int) -> list[tuple[str, float]]:
+        """Return the vertex ids of the n songs most similar to a song with the given features, in the order
+        of organize_levels, with their similarity scores to it in increasing order.
+
+        The songs are found by comparing the features with every song in the graph, rather than by choosing a song
+        from the decision tree and searching the graph from it. See SongGraph.find_closest_songs.
+        """
+        levels = dict(zip(LEVEL_FEATURES, features))
+        return self.graph.find_closest_songs(str(levels['genre']),
+                                             [float(levels[feature_name]) for feature_name in NUMERICAL_FEATURES], n)
+
+    def get_closest_song_count(self, features: list, n: int) -> dict[tuple[str, str], list[float]]:
+        """
+        Given a list of features, find the top n songs that are most similar to a song with those features.
+        Return a dictionary in the same format as get_similarity_score_count, where each song is only
+        counted once, with its score from the closest of its vertices.
+        """
+        counter = {}
+        for vertex_id, score in self.find_closest_songs(features, n):
+            song_artist = self.graph.get_song_artist(vertex_id)
+            if song_artist not in counter:
+                counter[song_artist] = [score]
+        return counter
+
+    def get_similarity_score_count(self, vertex_ids: list[str] | set[str],
+                                   n: int) -> dict[tuple[str, str], list[float]]:
         """
         Given a list of vertex ids, find the top n songs that are similar to each vertex id.
         Return a dictionary where the keys are tuples of song names and artists, that were
         similar to the any of the given vertex ids, and the values are lists of 
         similarity scores between the given vertex ids and the song indicated by the key.
+
+        The songs similar to the vertex ids are looked up in the recommendation table,
+        or searched for from each of them. See find_shortest_distances.
         """
         counter = {}
-        for vertex_id in vertex_ids:
-            shortest_distance = self.graph.find_shortest_distance(vertex_id, n)
+        for shortest_distance in self.find_shortest_distances(list(vertex_ids), n):
             for other_vertex_id, score in shortest_distance:
                 if other_vertex_id in vertex_ids:
                     continue
-                vertex_details = self.graph.get_vertex_details(other_vertex_id)
-                song_artist = (vertex_details['name'], '; '.join(vertex_details['artists']))
+                song_artist = self.graph.get_song_artist(other_vertex_id)
                 if song_artist not in counter:
                     counter[song_artist] = []
                 counter[song_artist].append(score)
@@ -128,28 +220,150 @@ class RecommendationSystem:
         previous non empty sublist's last song's (largest) score to the current sublist's first song's (smallest) score,
         to ensure that the scores are relative to each other.
         
-        If given a list of features, return a list of songs that are similar to the song with the given features.
+        If given a list of features, return a list of songs that are similar to the song with the given features,
+        which are found by find_closest_songs, or searched for from the closest song in the decision tree
+        if tree_search is True.
         """
         if not given_input:
             return []
-        if not all({isinstance(value, str) for value in given_input}):  # taking in a list of features
-            vertex_ids = {self.obtain_vertex_id(given_input)}
-            songs_to_check = 1
+        if _is_feature_list(given_input) and not self.tree_search:
+            counter, songs_to_check = self.get_closest_song_count(given_input, n), 1
+        else:
+            vertex_ids, songs_to_check = self.obtain_seed_vertex_ids(given_input)
+            counter = self.get_similarity_score_count(vertex_ids, n)
+        ordered_list = self.combine_similarity_score(counter, songs_to_check)
+        self.sort_and_format_scores(ordered_list, n)
+
+        return ordered_list
+
+    def obtain_seed_vertex_ids(self, given_input: list[str] | list) -> tuple[set[str], int]:
+        """Return the vertex ids of the songs to recommend songs similar to for the given input
+        of generate_recommendations, and the number of songs that the recommended songs can have in common with.
+
+        A list of features is only searched for from a song when tree_search is True, in which case
+        the song is the closest song in the decision tree.
+        """
+        if _is_feature_list(given_input):
+            return {self.obtain_vertex_id(given_input)}, 1
         else:
             vertex_ids = set(self.obtain_vertex_id(value) for value in given_input)
-            songs_to_check = len(vertex_ids)
+            return vertex_ids, len(vertex_ids)
+
+    def iter_shortest_distances(self, vertex_ids: list[str], n: int) -> Iterator[tuple[int, str, float]]:
+        """Yield (i, vertex_id, distance) for each item of find_shortest_distances(vertex_ids, n)[i],
+        in increasing order of distance across all the vertex ids.
+
+        If every vertex id is in the recommendation table, the items are merged from the table.
+        Otherwise, they are yielded as soon as they are found by graph.iter_shortest_distances.
+        """
+        if self.table is not None:
+            results = [self.table.find_shortest_distance(vertex_id, n) for vertex_id in vertex_ids]
+            if all(result is not None for result in results):
+                return heapq.merge(*[[(i, other_vertex_id, score) for other_vertex_id, score in result]
+                                     for i, result in enumerate(results)], key=lambda item: item[2])
+        return self.graph.iter_shortest_distances(vertex_ids, n)
 
-        counter = self.get_similarity_score_count(vertex_ids, n)
+    def generate_recommendations_stream(self, given_input: Optional[list[str] | list],
+                                        n: int = DEFAULT_RECOMMENDATION_COUNT) -> Iterator[tuple[int, str, str, float]]:
+        """Yield the first n recommendations of generate_recommendations(given_input, n), in the same order,
+        as (i, song name, artist names, relative similarity score) tuples where i is the index of the sublist
+        of the recommendation.
+
+        The recommendations in the first sublist, which are similar to every song in the input, are yielded
+        while the search is still running, as soon as no song that has not been yielded can have a lower score.
+        Since the search from each song finds the songs in increasing order of distance, a song that has not been
+        found from some of the input songs has at least the current distance from each of those songs.
+        The search stops as soon as n recommendations have been yielded. The recommendations in the other
+        sublists are yielded once the search is complete, since their scores are relative to the sublists before them.
+        The recommendations for a list of features are all found at once by find_closest_songs,
+        unless tree_search is True.
+        """
+        if not given_input:
+            return
+        if _is_feature_list(given_input) and not self.tree_search:
+            for i, sublist in enumerate(self.generate_recommendations(given_input, n)):
+                for song_name, artist_names, score in sublist:
+                    yield i, song_name, artist_names, score
+            return
+        vertex_ids, songs_to_check = self.obtain_seed_vertex_ids(given_input)
+        sources = list(vertex_ids)
+        counts = [0 for _ in sources]
+        # A dictionary mapping each song found to the (source number, rank, score) of each time it was found
+        hits = {}
+        # A heap of the (average score, first hit, song) of the songs found from every source that were not yielded
+        ready = []
+        # A heap for each number of sources that a song has not been found from yet, of the (sum of scores, song)
+        # of the songs that have been found from all the other sources. It is used by _lowest_possible_average.
+        partial = [[] for _ in range(songs_to_check)]
+        yielded = 0
+        for number, other_vertex_id, score in self.iter_shortest_distances(sources, n):
+            counts[number] += 1
+            if other_vertex_id in vertex_ids:
+                continue
+            song_artist = self.graph.get_song_artist(other_vertex_id)
+            if song_artist not in hits:
+                hits[song_artist] = []
+            hits[song_artist].append((number, counts[number], score))
+            song_hits = hits[song_artist]
+            if len(song_hits) == songs_to_check:
+                song_hits = sorted(song_hits)
+                average = sum(hit[2] for hit in song_hits) / songs_to_check
+                heapq.heappush(ready, (average, song_hits[0][:2], song_artist))
+            elif len(song_hits) < songs_to_check:
+                heapq.heappush(partial[songs_to_check - len(song_hits)],
+                               (sum(hit[2] for hit in song_hits), song_artist))
+            while ready and ready[0][0] < _lowest_possible_average(partial, hits, songs_to_check, score):
+                average, _, song_artist = heapq.heappop(ready)
+                yield 0, song_artist[0], song_artist[1], average
+                yielded += 1
+                if yielded == n:
+                    return
+
+        counter = {song_artist: [hit[2] for hit in sorted(song_hits)]
+                   for song_artist, song_hits in sorted(hits.items(), key=lambda item: min(item[1])[:2])}
         ordered_list = self.combine_similarity_score(counter, songs_to_check)
         self.sort_and_format_scores(ordered_list, n)
+        num_songs = yielded
+        for i, sublist in enumerate(ordered_list):
+            for song_name, artist_names, score in sublist[yielded if i == 0 else 0:]:
+                if num_songs == n:
+                    return
+                yield i, song_name, artist_names, score
+                num_songs += 1
 
-        return ordered_list
+
+def _is_feature_list(given_input: list) -> bool:
+    """Return whether the given input of generate_recommendations is a list of features rather than song names."""
+    return not all(isinstance(value, str) for value in given_input)
+
+
+def _lowest_possible_average(partial: list[list[tuple[float, tuple[str, str]]]],
+                             hits: dict[tuple[str, str], list[tuple[int, int, float]]],
+                             songs_to_check: int, distance: float) -> float:
+    """Return a lower bound on the average score of every song that has not been found from all songs_to_check
+    sources yet, when the search from every source is at the given distance.
+
+    hits maps each song found so far to the (source number, rank, score) of each time it was found, and
+    partial[m] is a heap of (sum of scores, song) for the songs that have not been found from m of the sources,
+    which may also contain outdated entries for songs that have since been found from more sources.
+    Such a song is at least distance away from each of the m sources, and a song that has not been found at all
+    is at least distance away from all of them. The bound is slightly lowered so that rounding errors in the
+    averages never make it too high.
+    """
+    lowest = distance
+    for missing, heap in enumerate(partial):
+        while heap and songs_to_check - len(hits[heap[0][1]]) != missing:
+            heapq.heappop(heap)
+        if heap:
+            lowest = min(lowest, (heap[0][0] + missing * distance) / songs_to_check)
+    return lowest - abs(lowest) * 1e-12
 
 
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['random', 'song_graph', 'song_decision_tree', 'generate_graph'],
+        'extra-imports': ['heapq', 'compact_graph', 'compact_tree', 'recommendation_table', 'search_cache',
+                          'song_graph', 'song_decision_tree', 'generate_graph'],
         'allowed-imports': [],
         'max-line-length': 120,
     })
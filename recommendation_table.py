@@ -0,0 +1,205 @@
+"""
+This module contains the RecommendationTable class, a table of the closest songs to every song in a graph,
+which is computed offline so that recommendations for songs in the catalogue are looked up instead of searched for.
+"""
+from __future__ import annotations
+
+import hashlib
+from functools import partial
+from typing import Callable, Optional
+
+import numpy as np
+
+from compact_graph import CompactSongGraph
+from snapshot import decode_strings, encode_strings, read_snapshot, write_snapshot
+from song_graph import SongGraph
+from worker_pool import run_in_worker, worker_pool
+
+# The number of closest songs stored for each song by default
+RECOMMENDATION_TABLE_SIZE = 50
+# The number of songs whose closest songs are searched for at once by a worker process
+TABLE_CHUNK_SIZE = 256
+
+
+class RecommendationTable:
+    """A table storing the result of find_shortest_distance(vertex_id, size) for every vertex of a graph.
+
+    The closest songs to the i-th vertex are neighbours[i, :lengths[i]], with the lengths of their shortest paths
+    in the same positions of distances, in increasing order of length. The rest of each row is padded with -1.
+
+    Instance Attributes:
+        - size: The number of closest songs stored for each vertex
+        - vertex_ids: The vertex id of each vertex
+        - neighbours: A (len(vertex_ids), size) array of the vertex numbers of the closest songs to each vertex
+        - distances: A (len(vertex_ids), size) array of the lengths of the shortest paths to those songs
+        - lengths: The number of closest songs stored for each vertex, which is less than size only if fewer
+            than size songs can be reached from it
+        - graph_fingerprint: The fingerprint of the graph this table was computed from
+
+    Representation Invariants:
+        - self.size > 0
+        - self.neighbours.shape == self.distances.shape == (len(self.vertex_ids), self.size)
+    """
+    size: int
+    vertex_ids: list[str]
+    neighbours: np.ndarray
+    distances: np.ndarray
+    lengths: np.ndarray
+    graph_fingerprint: str
+    # Private Instance Attributes:
+    #   - _positions:
+    #       A dictionary mapping each vertex id to its vertex number
+    _positions: dict[str, int]
+
+    def __init__(self, vertex_ids: list[str], neighbours: np.ndarray, distances: np.ndarray,
+                 graph_fingerprint: str) -> None:
+        """Initialize a table with the given vertex ids, closest songs and path lengths,
+        computed from the graph with the given fingerprint.
+        """
+        self.size = neighbours.shape[1]
+        self.vertex_ids = vertex_ids
+        self.neighbours = neighbours
+        self.distances = distances
+        self.lengths = np.count_nonzero(neighbours >= 0, axis=1)
+        self.graph_fingerprint = graph_fingerprint
+        self._positions = {vertex_id: position for position, vertex_id in enumerate(vertex_ids)}
+
+    def find_shortest_distance(self, vertex_id: str, n: int) -> Optional[list[tuple[str, float]]]:
+        """Return the same list as graph.find_shortest_distance(vertex_id, n) for the graph this table was
+        computed from, or None if vertex_id is not in the table or n is larger than the number of songs stored
+        for it and more songs can be reached from it.
+
+        Preconditions:
+            - n > 0
+        """
+        position = self._positions.get(vertex_id)
+        if position is None:
+            return None
+        length = int(self.lengths[position])
+        if n > length and length == self.size:
+            return None
+        count = min(n, length)
+        return [(self.vertex_ids[neighbour], distance) for neighbour, distance in
+                zip(self.neighbours[position, :count].tolist(), self.distances[position, :count].tolist())]
+
+    def save(self, path: str) -> None:
+        """Save this table to a snapshot file at path, whose fingerprint is the fingerprint of the graph."""
+        write_snapshot(path, self.graph_fingerprint, {
+            'vertex_ids': encode_strings(self.vertex_ids),
+            'neighbours': self.neighbours,
+            'distances': self.distances
+        }, {'vertex_count': len(self.vertex_ids)})
+
+    @staticmethod
+    def load(path: str, graph_fingerprint: str, mmap: bool = True) -> RecommendationTable:
+        """Return the table saved at path by RecommendationTable.save, which must have been computed from
+        the graph with the given fingerprint. If mmap is True, the table is memory-mapped from the file.
+
+        Raise a ValueError if the file is not a snapshot or was computed from a different graph.
+        """
+        arrays, metadata = read_snapshot(path, graph_fingerprint, mmap)
+        return RecommendationTable(decode_strings(arrays['vertex_ids'], metadata['vertex_count']),
+                                   arrays['neighbours'], arrays['distances'], graph_fingerprint)
+
+
+def graph_fingerprint(graph: SongGraph | CompactSongGraph) -> str:
+    """Return a fingerprint of the vertex ids and edges of the given graph, which a RecommendationTable
+    is only valid for.
+    """
+    fingerprint = hashlib.sha256()
+    arrays = graph.to_arrays()
+    for name in ('vertex_ids', 'offsets', 'neighbours', 'scores'):
+        array = np.ascontiguousarray(arrays[name])
+        fingerprint.update(name.encode('utf-8'))
+        fingerprint.update(array.dtype.str.encode('utf-8'))
+        fingerprint.update(array.tobytes())
+    return fingerprint.hexdigest()
+
+
+def _table_worker(arrays: dict[str, np.ndarray]) -> Callable[[range, int], tuple[np.ndarray, np.ndarray]]:
+    """Return the function that computes rows of the recommendation table of the graph with the given arrays,
+    which were returned by to_arrays. It is the task of each worker process of the pool used by
+    build_recommendation_table, and is also used when there is a single worker. See worker_pool.
+    """
+    graph = _uncached_graph(arrays)
+    vertex_numbers = {vertex_id: position for position, vertex_id in enumerate(graph.vertex_ids)}
+    return partial(_table_rows, graph, vertex_numbers)
+
+
+def _uncached_graph(arrays: dict[str, np.ndarray]) -> CompactSongGraph:
+    """Return the graph with the given arrays, which were returned by to_arrays, without a search cache
+    since every song is only searched from once.
+    """
+    graph = CompactSongGraph(arrays)
+    graph.search_cache.resize(0)
+    return graph
+
+
+def _table_rows(graph: CompactSongGraph, vertex_numbers: dict[str, int], positions: range,
+                size: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the rows of the recommendation table of the given size for the vertices with the given numbers,
+    where vertex_numbers maps each vertex id of the graph to its vertex number.
+    """
+    neighbours = np.full((len(positions), size), -1, dtype=np.int32)
+    distances = np.full((len(positions), size), np.inf)
+    for row, position in enumerate(positions):
+        nearest = graph.find_shortest_distance(graph.vertex_ids[position], size)
+        neighbours[row, :len(nearest)] = [vertex_numbers[vertex_id] for vertex_id, _ in nearest]
+        distances[row, :len(nearest)] = [distance for _, distance in nearest]
+    return neighbours, distances
+
+
+def build_recommendation_table(graph: SongGraph | CompactSongGraph, size: int = RECOMMENDATION_TABLE_SIZE,
+                               workers: int = 1) -> RecommendationTable:
+    """Return a table of the size closest songs to every song in the given graph, searched for in chunks of
+    TABLE_CHUNK_SIZE songs by a pool of the given number of worker processes.
+
+    Preconditions:
+        - size > 0
+        - workers > 0
+    """
+    arrays = graph.to_arrays()
+    count = len(arrays['genres'])
+    chunks = [range(start, min(start + TABLE_CHUNK_SIZE, count)) for start in range(0, count, TABLE_CHUNK_SIZE)]
+    if workers > 1:
+        with worker_pool(workers, _table_worker, arrays) as executor:
+            rows = list(executor.map(partial(run_in_worker, _table_worker), chunks, [size] * len(chunks)))
+    else:
+        table_rows = _table_worker(arrays)
+        rows = [table_rows(chunk, size) for chunk in chunks]
+
+    neighbours = np.concatenate([chunk_neighbours for chunk_neighbours, _ in rows] +
+                                [np.zeros((0, size), dtype=np.int32)])
+    distances = np.concatenate([chunk_distances for _, chunk_distances in rows] + [np.zeros((0, size))])
+    return RecommendationTable(decode_strings(arrays['vertex_ids'], count), neighbours, distances,
+                               graph_fingerprint(graph))
+
+
+def load_recommendation_table(path: str, graph: SongGraph | CompactSongGraph, size: int = RECOMMENDATION_TABLE_SIZE,
+                              workers: int = 1) -> RecommendationTable:
+    """Return the recommendation table of the given size for the given graph, loading it from path if it was
+    computed from the same graph with the same size. Otherwise, build it with build_recommendation_table
+    and save it to path.
+    """
+    fingerprint = graph_fingerprint(graph)
+    try:
+        table = RecommendationTable.load(path, fingerprint)
+        if table.size == size:
+            return table
+    except (OSError, ValueError, KeyError):
+        pass
+
+    table = build_recommendation_table(graph, size, workers)
+    try:
+        table.save(path)
+    except OSError:
+        pass
+    return table
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['hashlib', 'functools', 'numpy', 'compact_graph', 'snapshot', 'song_graph', 'worker_pool'],
+        'max-line-length': 120,
+    })
@@ -0,0 +1,117 @@
+"""
+This module contains the SearchCache class, a bounded cache of the songs found by find_shortest_distance,
+so that the searches from popular songs are not repeated every time they are selected.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Optional
+
+# The number of songs whose search results are cached by default
+SEARCH_CACHE_SIZE = 1024
+
+
+class SearchCache:
+    """A thread-safe cache mapping a vertex id to the result of find_shortest_distance(vertex_id, n) for some n,
+    which evicts the least recently used vertex id once it holds more than size results.
+
+    The result for a vertex id with some n also answers any smaller n, since it is the first n items
+    of the same list. A result with fewer than n items is the complete list of reachable songs,
+    so it answers every n.
+
+    Instance Attributes:
+        - size: The max number of results held, where 0 disables the cache
+        - hits: The number of lookups answered by the cache
+        - misses: The number of lookups that were not answered by the cache
+
+    Representation Invariants:
+        - self.size >= 0
+        - self.hits >= 0
+        - self.misses >= 0
+    """
+    size: int
+    hits: int
+    misses: int
+    # Private Instance Attributes:
+    #   - _results:
+    #       A dictionary mapping each cached vertex id to the n it was searched with and the result,
+    #       from the least to the most recently used
+    #   - _lock:
+    #       The lock held while reading or changing the cache
+    _results: OrderedDict[str, tuple[int, list[tuple[str, float]]]]
+    _lock: Lock
+
+    def __init__(self, size: int = SEARCH_CACHE_SIZE) -> None:
+        """Initialize an empty cache holding at most size results.
+
+        Preconditions:
+            - size >= 0
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, vertex_id: str, n: int) -> Optional[list[tuple[str, float]]]:
+        """Return the cached result of find_shortest_distance(vertex_id, n),
+        or None if it is not in the cache.
+
+        Preconditions:
+            - n > 0
+        """
+        with self._lock:
+            if vertex_id in self._results:
+                cached_n, result = self._results[vertex_id]
+                if n <= cached_n or len(result) < cached_n:
+                    self._results.move_to_end(vertex_id)
+                    self.hits += 1
+                    return result[:n]
+            self.misses += 1
+            return None
+
+    def put(self, vertex_id: str, n: int, result: list[tuple[str, float]]) -> None:
+        """Cache the given result of find_shortest_distance(vertex_id, n), unless a result for a larger n
+        is already cached.
+
+        Preconditions:
+            - n > 0
+        """
+        with self._lock:
+            if self.size == 0:
+                return
+            if vertex_id not in self._results or self._results[vertex_id][0] < n:
+                self._results[vertex_id] = (n, list(result))
+            self._results.move_to_end(vertex_id)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+    def resize(self, size: int) -> None:
+        """Change the max number of results held to size, evicting the least recently used results if needed.
+
+        Preconditions:
+            - size >= 0
+        """
+        with self._lock:
+            self.size = size
+            while len(self._results) > size:
+                self._results.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove every result from the cache. This must be called whenever the graph changes."""
+        with self._lock:
+            self._results.clear()
+
+    def info(self) -> dict[str, Any]:
+        """Return a dictionary with the hits, misses, size and number of results currently held by this cache."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': self.size, 'length': len(self._results)}
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['collections', 'threading'],
+        'max-line-length': 120,
+    })
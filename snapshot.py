@@ -0,0 +1,116 @@
+"""
+This module reads and writes snapshot files, a compact binary format for saving the objects used by the
+recommendation system so they do not have to be rebuilt from the datasets every time the program starts.
+
+A snapshot file contains a header followed by the raw bytes of a number of numpy arrays:
+    - the 8 byte SNAPSHOT_MAGIC
+    - the length of the header as an 8 byte little endian integer
+    - the header, a utf-8 encoded JSON object with the fingerprint of the snapshot, a dictionary of metadata,
+      and the dtype, shape and offset in the file of every array
+    - the data of each array, starting at an offset that is a multiple of ARRAY_ALIGNMENT
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b'SONGSNAP'
+ARRAY_ALIGNMENT = 64
+# The character separating the strings stored in a string table
+STRING_SEPARATOR = '\0'
+
+
+def encode_strings(strings: list[str]) -> np.ndarray:
+    """Return a string table storing the given strings, as an array of utf-8 bytes.
+
+    Preconditions:
+        - all(STRING_SEPARATOR not in string for string in strings)
+    """
+    return np.frombuffer(STRING_SEPARATOR.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def decode_strings(table: np.ndarray, count: int) -> list[str]:
+    """Return the count strings stored in the given string table."""
+    if count == 0:
+        return []
+    return table.tobytes().decode('utf-8').split(STRING_SEPARATOR)
+
+
+def write_snapshot(path: str, fingerprint: str, arrays: dict[str, np.ndarray], metadata: dict[str, Any]) -> None:
+    """Write a snapshot file with the given fingerprint, arrays and JSON serializable metadata to path.
+
+    The file is written next to path first and then moved into place, so a snapshot that is being written
+    is never read by another process.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    header = json.dumps({'fingerprint': fingerprint, 'metadata': metadata, 'arrays': layout}).encode('utf-8')
+    data_start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header)) // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]['offset'])
+            file.write(array.tobytes())
+        file.truncate(data_start + offset)
+    os.replace(temporary_path, path)
+
+
+def read_snapshot_header(path: str) -> tuple[dict[str, Any], int]:
+    """Return the header of the snapshot file at path, and the offset in the file where its array data starts.
+
+    Raise a ValueError if the file is not a snapshot file.
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError
+        header_length = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(header_length).decode('utf-8'))
+    data_start = -(-(len(SNAPSHOT_MAGIC) + 8 + header_length) // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+    return header, data_start
+
+
+def read_snapshot(path: str, fingerprint: str, mmap: bool = False) -> tuple[dict[str, np.ndarray], dict[str, Any]]:
+    """Return the arrays and metadata stored in the snapshot file at path.
+
+    If mmap is True, the arrays are read-only numpy.memmap views of the file instead of copies in memory,
+    so every process that maps the same snapshot shares one physical copy of the arrays.
+
+    Raise a ValueError if the file is not a snapshot file or its fingerprint is not the given fingerprint.
+    """
+    header, data_start = read_snapshot_header(path)
+    if header['fingerprint'] != fingerprint:
+        raise ValueError
+    if mmap:
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+    else:
+        with open(path, 'rb') as file:
+            data = np.frombuffer(file.read(), dtype=np.uint8)
+
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        dtype = np.dtype(layout['dtype'])
+        start = data_start + layout['offset']
+        stop = start + int(np.prod(layout['shape'])) * dtype.itemsize
+        arrays[name] = data[start:stop].view(dtype).reshape(layout['shape'])
+    return arrays, header['metadata']
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['json', 'os', 'numpy'],
+        'allowed-io': ['write_snapshot', 'read_snapshot_header', 'read_snapshot'],
+        'max-line-length': 120,
+    })
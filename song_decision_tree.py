@@ -4,9 +4,16 @@ for a feature of the song's characteristics.
 """
 from __future__ import annotations
 
+import bisect
 import random
 from typing import Any, Optional
 
+import numpy as np
+
+# The song characteristics in the order of the levels of a SongDecisionTree, as listed by organize_levels
+LEVEL_FEATURES = ("genre", "danceability", "energy", "valence", "key", "tempo", "instrumentalness", "mode",
+                  "acousticness", "loudness", "liveness", "speechiness")
+
 
 def organize_levels(levels: dict) -> list:
     """
@@ -30,10 +37,7 @@ def organize_levels(levels: dict) -> list:
     - "liveness" in levels
     - "speechiness" in levels
     """
-    return [levels.get("genre"), levels.get("danceability"), levels.get("energy"),
-            levels.get("valence"), levels.get("key"), levels.get("tempo"),
-            levels.get("instrumentalness"), levels.get("mode"), levels.get("acousticness"),
-            levels.get("loudness"), levels.get("liveness"), levels.get("speechiness")]
+    return [levels.get(feature_name) for feature_name in LEVEL_FEATURES]
 
 
 NODES_PER_LEVEL = organize_levels(
@@ -72,6 +76,8 @@ class SongDecisionTree:
     Representation Invariants:
         - self._root is not None or self._subtrees == []
         - all(not subtree.is_empty() for subtree in self._subtrees)
+        - self._children == {subtree._root: subtree for subtree in self._subtrees}
+        - self._numbers == sorted(subtree._root for subtree in self._subtrees if not isinstance(subtree._root, str))
     """
     # Private Instance Attributes:
     #   - _root:
@@ -81,8 +87,14 @@ class SongDecisionTree:
     #       self._root is None (representing an empty tree). However, this attribute
     #       may be empty when self._root is not None, which represents a tree consisting
     #       of just one item.
+    #   - _children:
+    #       A dictionary mapping the root of each subtree to that subtree.
+    #   - _numbers:
+    #       The roots of the subtrees that are numbers, in increasing order.
     _root: Optional[Any]
     _subtrees: list[SongDecisionTree]
+    _children: dict[Any, SongDecisionTree]
+    _numbers: list[float | int]
 
     def __init__(self, root: Optional[Any], subtrees: list[SongDecisionTree]) -> None:
         """Initialize a new SongDecisionTree with the given root value and subtrees.
@@ -93,7 +105,36 @@ class SongDecisionTree:
             - root is not None or subtrees == []
         """
         self._root = root
-        self._subtrees = subtrees
+        self._subtrees = []
+        self._children = {}
+        self._numbers = []
+        for subtree in subtrees:
+            self._add_subtree(subtree)
+
+    def _add_subtree(self, subtree: SongDecisionTree) -> None:
+        """Add the given subtree to this tree, after its other subtrees.
+
+        Preconditions:
+            - subtree._root not in self._children
+        """
+        self._subtrees.append(subtree)
+        self._children[subtree._root] = subtree
+        if not isinstance(subtree._root, str):
+            bisect.insort(self._numbers, subtree._root)
+
+    def _closest_subtree(self, value: float) -> SongDecisionTree:
+        """Return the subtree whose root is the number closest to value.
+        Of two roots that are equally close, the smaller one is chosen.
+
+        Preconditions:
+            - self._numbers != []
+        """
+        i = bisect.bisect_left(self._numbers, value)
+        if i == len(self._numbers):
+            i -= 1
+        elif i > 0 and value - self._numbers[i - 1] <= self._numbers[i] - value:
+            i -= 1
+        return self._children[self._numbers[i]]
 
     def insert_song(self, items: list) -> None:
         """Insert the given items into this tree such that each item is the child of the item before it,
@@ -101,29 +142,29 @@ class SongDecisionTree:
         """
         if len(items) > 0:
             first_item = items[0]
-            for subtree in self._subtrees:
-                if subtree._root == first_item:
-                    subtree.insert_song(items[1:])
-                    return
-            new_tree = create_tree(items)
-            self._subtrees.append(new_tree)
+            if first_item in self._children:
+                self._children[first_item].insert_song(items[1:])
+            else:
+                self._add_subtree(create_tree(items))
 
     def find_related_songs(self, inputs: list) -> list:
         """
         Each input in the list is a value for a feature of the song's characteristics.
         Traverse through the tree by going down the path with the closest value to the first input.
         Return the leaf nodes when there are no more inputs.
+
+        The subtree with the same root as an input is found in the dictionary of subtrees, and the subtree with
+        the closest number to it in the sorted list of numbers, so each level takes O(log k) time for k subtrees.
+        Of two numbers that are equally close to an input, the smaller one is followed. If no subtree matches
+        an input and no subtree has a number as its root, a random subtree is followed.
         """
         if len(inputs) == 0:
             return [cur_subtree._root for cur_subtree in self._subtrees]
-        closest_tree = self._subtrees[random.randint(0, len(self._subtrees) - 1)]
-        for subtree in self._subtrees:
-            if not isinstance(subtree._root, str):
-                if abs(subtree._root - float(inputs[0])) < abs(closest_tree._root - float(inputs[0])):
-                    closest_tree = subtree
-            elif subtree._root == inputs[0]:
-                return subtree.find_related_songs(inputs[1:])
-        return closest_tree.find_related_songs(inputs[1:])
+        if inputs[0] in self._children:
+            return self._children[inputs[0]].find_related_songs(inputs[1:])
+        if self._numbers:
+            return self._closest_subtree(float(inputs[0])).find_related_songs(inputs[1:])
+        return self._subtrees[random.randint(0, len(self._subtrees) - 1)].find_related_songs(inputs[1:])
 
 
 def create_tree(items: list) -> Optional[SongDecisionTree]:
@@ -137,38 +178,63 @@ def create_tree(items: list) -> Optional[SongDecisionTree]:
     return None
 
 
-def check_closest_val(cur_val: float | int, new_val: float | int, comparing_value: float | int) -> float | int:
-    """
-    Given a current value, a new value, and a comparing value,
-    return the value that is closest to the comparing value.
-    """
-    if abs(new_val - float(comparing_value)) < abs(cur_val - float(comparing_value)):
-        return new_val
-    return cur_val
+# The options of each level of NODES_PER_LEVEL in increasing order, or None for the levels of strings
+_SORTED_OPTIONS = tuple(None if isinstance(options[0], str) else sorted(options) for options in NODES_PER_LEVEL)
+# The boundaries between consecutive options of each level of numbers: the midpoints of the sorted options
+_OPTION_BOUNDARIES = tuple(None if options is None else (np.array(options[:-1]) + np.array(options[1:])) / 2
+                           for options in _SORTED_OPTIONS)
 
 
 def round_values(inputs: list) -> list:
     """
     Given a list of inputs, round each numerical input to the closest value according to the NODES_PER_LEVEL list.
+
+    Of two values that are equally close to an input, the smaller one is chosen. A string input is kept as it is.
+    See round_value_rows.
     """
-    res = []
-    for i in range(len(inputs)):
-        closest_val = NODES_PER_LEVEL[i][random.randint(0, len(NODES_PER_LEVEL[i]) - 1)]
+    return round_value_rows([inputs])[0]
+
 
-        if not isinstance(NODES_PER_LEVEL[i][0], str):
-            for opt in NODES_PER_LEVEL[i]:
-                closest_val = check_closest_val(closest_val, opt, inputs[i])
-        elif inputs[i] in NODES_PER_LEVEL[i]:
-            closest_val = inputs[i]
-        res.append(closest_val)
-    return res
+def round_value_rows(rows: list[list]) -> list[list]:
+    """Return round_values(inputs) for each list of inputs in rows, rounding each level of every row at once.
+
+    Each input is located among the sorted boundaries between the options of its level with a binary search, then
+    compared with the options on either side of it, so every input is rounded to exactly the closest option.
+
+    Preconditions:
+        - all(len(inputs) == len(rows[0]) for inputs in rows)
+        - rows == [] or len(rows[0]) <= len(NODES_PER_LEVEL)
+    """
+    if not rows:
+        return []
+    columns = []
+    for i in range(len(rows[0])):
+        if _SORTED_OPTIONS[i] is None:
+            columns.append([inputs[i] for inputs in rows])
+        else:
+            values = np.array([float(inputs[i]) for inputs in rows])
+            columns.append([_SORTED_OPTIONS[i][index] for index in _closest_options(i, values).tolist()])
+    return [list(row) for row in zip(*columns)]
+
+
+def _closest_options(level: int, values: np.ndarray) -> np.ndarray:
+    """Return the index in _SORTED_OPTIONS[level] of the option closest to each of the given values,
+    choosing the smaller of two options that are equally close.
+    """
+    options = np.array(_SORTED_OPTIONS[level], dtype=float)
+    indices = np.searchsorted(_OPTION_BOUNDARIES[level], values)
+    # A rounding error in a boundary can only move a value to a neighbouring option, so compare with both neighbours
+    lower = np.maximum(indices - 1, 0)
+    indices = np.where(np.abs(options[lower] - values) <= np.abs(options[indices] - values), lower, indices)
+    upper = np.minimum(indices + 1, len(options) - 1)
+    return np.where(np.abs(options[upper] - values) < np.abs(options[indices] - values), upper, indices)
 
 
 if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['random'],
+        'extra-imports': ['bisect', 'random', 'numpy'],
         'allowed-imports': [],
         'max-line-length': 120,
     })
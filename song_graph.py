@@ -5,7 +5,19 @@ some stuffs
 """
 from __future__ import annotations
 import heapq
-from typing import Any
+import math
+import sys
+import time
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from nn_descent import NN_DESCENT_ITERATIONS, nn_descent
+from search_cache import SearchCache
+from snapshot import encode_strings, decode_strings
+from spatial_index import KDTree
+from worker_pool import run_in_worker, worker_pool
 
 SIMILARITY_WEIGHTING = {
     "genre": 4.0,
@@ -23,123 +35,493 @@ SIMILARITY_WEIGHTING = {
 }
 # The max limit at which a similarity score can be in order to add an edge
 SCORE_LIMIT = 2.25
+# The numerical features compared by the similarity score, in the order of the columns of the feature matrices
+NUMERICAL_FEATURES = ("danceability", "energy", "valence", "key", "mode", "tempo", "loudness",
+                      "speechiness", "acousticness", "instrumentalness", "liveness")
+# The numerical features that only take integer values
+INTEGER_FEATURES = ("key", "mode")
+# The column of each numerical feature in the feature matrices
+_FEATURE_COLUMNS = {feature_name: column for column, feature_name in enumerate(NUMERICAL_FEATURES)}
+# The (column, weight, whether the difference is relative) of each numerical feature, in the order they are summed
+# by the similarity score. The largest weights come first, so that a score which exceeds a limit does so early.
+_SCORE_TERMS = tuple((_FEATURE_COLUMNS[feature_name], SIMILARITY_WEIGHTING[feature_name], feature_name == "tempo")
+                     for feature_name in sorted(NUMERICAL_FEATURES, key=lambda name: -SIMILARITY_WEIGHTING[name]))
+# The number of songs scored against each other at once when generating all edges of the graph
+EDGE_BLOCK_SIZE = 1024
+# The number of tiles of blocks given to each worker process when generating edges in parallel
+TILES_PER_WORKER = 4
+# When at most 1 / SPARSE_PAIR_FRACTION of the pairs of a block can still score less than the limit,
+# the rest of their scores are computed pair by pair rather than for the whole block
+SPARSE_PAIR_FRACTION = 4
+
+
+def song_artist(name: str, artists: Iterable[str]) -> tuple[str, str]:
+    """Return the name of a song and its artists joined by '; ', as shown in recommendations.
+
+    Both strings are interned with sys.intern, so the songs with the same name or artists share one copy of it.
+    """
+    return sys.intern(name), sys.intern('; '.join(artists))
+
+
+def genres_are_disconnected() -> bool:
+    """Return whether two songs of different genres can never be joined by an edge.
+
+    This is the case when the genre mismatch penalty alone reaches SCORE_LIMIT, since every other
+    term of the similarity score is non-negative. Edge generation then only compares songs of the same genre.
+    """
+    return (SIMILARITY_WEIGHTING["genre"] >= SCORE_LIMIT
+            and all(SIMILARITY_WEIGHTING[feature_name] >= 0 for feature_name in NUMERICAL_FEATURES))
 
 
 class _Vertex:
-    """A Vertex representing a song in the graph.
+    """A view of a vertex representing a song in the graph.
 
-    This class stores information about a song, including its ID, name, artists, and various
-    musical attributes. It also tracks the neighbouring vertices (songs) in the graph.
+    The information about every song, including its ID, name, artists, and various musical attributes,
+    is stored column-wise in the SongGraph that contains it. A _Vertex only records its graph and its row
+    in those columns, and reads the attributes of the song from there when they are accessed, through the get_row
+    methods of the graph.
 
     Instance Attributes:
-        - vertex_id: A unique identifier for the song.
-        - name: The name of the song.
-        - artists: A set of artists associated with the song.
-        - danceability: The danceability score of the song.
-        - energy: The energy level of the song.
-        - key: The musical key of the song (integer).
-        - loudness: The loudness of the song.
-        - mode: The mode (musical scale) of the song (integer).
-        - speechiness: The speechiness score of the song.
-        - acousticness: The acousticness score of the song.
-        - instrumentalness: The instrumentalness score of the song.
-        - liveness: The liveness score of the song.
-        - valence: The valence score of the song.
-        - tempo: The tempo (beats per minute) of the song.
-        - track_genre: The genre of the song.
-        - neighbours: A dictionary mapping neighbouring vertices to their similarity score.
+        - graph: The graph containing this vertex.
+        - position: The row of this vertex in the columns of the graph.
+
+    Each attribute in NUMERICAL_FEATURES can also be read as an attribute of the vertex.
 
     Representation Invariants:
-        - 0 <= danceability <= 1
-        - 0 <= energy <= 1
-        - 0 <= key <= 11
-        - 0 <= mode <= 1
-        - 0 <= speechiness <= 1
-        - 0 <= acousticness <= 1
-        - 0 <= instrumentalness <= 1
-        - 0 <= liveness <= 1
-        - 0 <= valence <= 1
-        - 0 <= tempo
+        - 0 <= self.position < len(self.graph.get_all_vertices())
+        - 0 <= self.danceability <= 1
+        - 0 <= self.energy <= 1
+        - 0 <= self.key <= 11
+        - 0 <= self.mode <= 1
+        - 0 <= self.speechiness <= 1
+        - 0 <= self.acousticness <= 1
+        - 0 <= self.instrumentalness <= 1
+        - 0 <= self.liveness <= 1
+        - 0 <= self.valence <= 1
+        - 0 <= self.tempo
     """
-    vertex_id: str
-    name: str
-    artists: set[str]
-    danceability: float
-    energy: float
-    key: int
-    loudness: float
-    mode: int
-    speechiness: float
-    acousticness: float
-    instrumentalness: float
-    liveness: float
-    valence: float
-    tempo: float
-    track_genre: str
-    neighbours: dict[_Vertex, float]
-
-    def __init__(
-            self, vertex_id: str, name: str, artists: set[str],
-            danceability: str, energy: str, key: str, loudness: str,
-            mode: int, speechiness: str, acousticness: str,
-            instrumentalness: str, liveness: str, valence: str,
-            tempo: str, track_genre: str
-    ) -> None:
-        """ Initialize a new vertex based on the given data"""
-        self.vertex_id = vertex_id
-        self.name = name
-        self.artists = artists
-        self.danceability = float(danceability)
-        self.energy = float(energy)
-        self.key = int(key)
-        self.loudness = float(loudness)
-        self.mode = int(mode)
-        self.speechiness = float(speechiness)
-        self.acousticness = float(acousticness)
-        self.instrumentalness = float(instrumentalness)
-        self.liveness = float(liveness)
-        self.valence = float(valence)
-        self.tempo = float(tempo)
-        self.track_genre = track_genre
-
-        self.neighbours = {}
+    __slots__ = ('graph', 'position')
+    graph: SongGraph
+    position: int
+
+    def __init__(self, graph: SongGraph, position: int) -> None:
+        """Initialize a view of the vertex in the given row of the graph"""
+        self.graph = graph
+        self.position = position
+
+    def __eq__(self, other: Any) -> bool:
+        """Return whether other is a view of the same vertex"""
+        return isinstance(other, _Vertex) and self.graph is other.graph and self.position == other.position
+
+    def __hash__(self) -> int:
+        """Return a hash of this vertex, which only depends on its row"""
+        return hash(self.position)
+
+    def __getattr__(self, name: str) -> float | int:
+        """Return the value of the numerical feature with the given name for this vertex"""
+        if name not in _FEATURE_COLUMNS:
+            raise AttributeError(name)
+        return self.graph.get_row_feature(self.position, name)
+
+    @property
+    def vertex_id(self) -> str:
+        """A unique identifier for the song."""
+        return self.graph.get_row_vertex_id(self.position)
+
+    @property
+    def name(self) -> str:
+        """The name of the song."""
+        return self.graph.get_row_name(self.position)
+
+    @property
+    def artists(self) -> set[str]:
+        """A set of artists associated with the song."""
+        return set(self.graph.get_row_artists(self.position))
+
+    @property
+    def track_genre(self) -> str:
+        """The genre of the song."""
+        return self.graph.get_row_genre(self.position)
+
+    @property
+    def neighbours(self) -> dict[_Vertex, float]:
+        """A dictionary mapping neighbouring vertices to their similarity score."""
+        return {_Vertex(self.graph, neighbour): score
+                for neighbour, score in self.graph.get_row_neighbours(self.position).items()}
 
     def degree(self) -> int:
         """Return the degree of this vertex"""
-        return len(self.neighbours)
+        return len(self.graph.get_row_neighbours(self.position))
 
-    def get_similarity(self, other: _Vertex) -> float:
+    def get_similarity(self, other: _Vertex, limit: float = math.inf) -> float:
         """
         Calculates the similarity score of 2 vertices by comparing attributes and providing them with a weighted value.
+
+        If the score reaches limit, the partial score is returned as soon as it does. See bounded_similarity.
         """
-        score = 0
-
-        if self.track_genre != other.track_genre:
-            score += SIMILARITY_WEIGHTING["genre"]
-
-        numerical_features = [
-            ("danceability", self.danceability, other.danceability, SIMILARITY_WEIGHTING["danceability"]),
-            ("energy", self.energy, other.energy, SIMILARITY_WEIGHTING["energy"]),
-            ("valence", self.valence, other.valence, SIMILARITY_WEIGHTING["valence"]),
-            ("key", self.key, other.key, SIMILARITY_WEIGHTING["key"]),
-            ("mode", self.mode, other.mode, SIMILARITY_WEIGHTING["mode"]),
-            ("tempo", self.tempo, other.tempo, SIMILARITY_WEIGHTING["tempo"]),
-            ("loudness", self.loudness, other.loudness, SIMILARITY_WEIGHTING["loudness"]),
-            ("speechiness", self.speechiness, other.speechiness, SIMILARITY_WEIGHTING["speechiness"]),
-            ("acousticness", self.acousticness, other.acousticness, SIMILARITY_WEIGHTING["acousticness"]),
-            ("instrumentalness", self.instrumentalness, other.instrumentalness,
-             SIMILARITY_WEIGHTING["instrumentalness"]),
-            ("liveness", self.liveness, other.liveness, SIMILARITY_WEIGHTING["liveness"])
-        ]
-
-        for feature_name, val1, val2, weight in numerical_features:
-            if feature_name == "tempo":
-                tempo_diff = abs(val1 - val2) / max(val1, val2) if max(val1, val2) > 0 else 0
-                score += weight * tempo_diff ** 2
-            else:
-                score += weight * (val1 - val2) ** 2
-
-        return score
+        return bounded_similarity(self.graph.get_feature_table(), self.position,
+                                  other.graph.get_feature_table(), other.position,
+                                  self.track_genre == other.track_genre, limit)
+
+
+def bounded_similarity(features1: Any, position1: int, features2: Any, position2: int, same_genre: bool,
+                       limit: float = math.inf) -> float:
+    """Return the similarity score of the song in column position1 of features1 and the song in column position2
+    of features2, which are in the same genre if same_genre is True.
+
+    features1 and features2 are indexed by [column, position], where the columns are in the order of
+    NUMERICAL_FEATURES, such as the memoryview of the features of a SongGraph. The values are read one at a time,
+    so no list of the features of either song is built.
+
+    The terms of the score are summed in _SCORE_TERMS order, largest weight first. As soon as the sum reaches limit,
+    it is returned without adding the remaining terms. When every weight is non-negative, the sum can only grow,
+    so the returned value is less than limit exactly when the full score is.
+    """
+    score = 0 if same_genre else SIMILARITY_WEIGHTING["genre"]
+    for column, weight, relative in _SCORE_TERMS:
+        if score >= limit:
+            return score
+        val1 = features1[column, position1]
+        val2 = features2[column, position2]
+        if relative:
+            diff = abs(val1 - val2) / max(val1, val2) if max(val1, val2) > 0 else 0
+        else:
+            diff = val1 - val2
+        score += weight * (diff * diff)
+    return score
+
+
+def similarity_block(features1: np.ndarray, genres1: np.ndarray,
+                     features2: np.ndarray, genres2: np.ndarray) -> np.ndarray:
+    """Return the matrix of similarity scores between every song in the first block and every song in the second.
+
+    Each row of features1 and features2 holds the NUMERICAL_FEATURES of one song, and genres1 and genres2 hold
+    an integer code for the genre of each row. The scores are summed in the same order as bounded_similarity,
+    so entry [i, j] is exactly the score bounded_similarity returns for the two songs.
+
+    Preconditions:
+        - features1.shape[0] == genres1.shape[0]
+        - features2.shape[0] == genres2.shape[0]
+    """
+    scores = np.where(genres1[:, None] != genres2[None, :], SIMILARITY_WEIGHTING["genre"], 0.0)
+    for column, weight, relative in _SCORE_TERMS:
+        scores += weight * _squared_differences(features1[:, column, None], features2[None, :, column], relative)
+    return scores
+
+
+def paired_similarity(features1: np.ndarray, genres1: np.ndarray,
+                      features2: np.ndarray, genres2: np.ndarray) -> np.ndarray:
+    """Return the similarity score between the i-th song of the first block and the i-th song of the second,
+    for every i. The scores are summed in the same order as bounded_similarity.
+
+    Preconditions:
+        - features1.shape == features2.shape
+        - genres1.shape == genres2.shape == (features1.shape[0],)
+    """
+    scores = np.where(genres1 != genres2, SIMILARITY_WEIGHTING["genre"], 0.0)
+    for column, weight, relative in _SCORE_TERMS:
+        scores += weight * _squared_differences(features1[:, column], features2[:, column], relative)
+    return scores
+
+
+def bounded_similarity_block(features1: np.ndarray, genres1: np.ndarray,
+                             features2: np.ndarray, genres2: np.ndarray,
+                             limit: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the row in the first block, the row in the second block and the similarity score of every pair of songs
+    whose similarity score is less than limit, as three parallel arrays.
+
+    This is the batched version of bounded_similarity. The terms are added in the same order, to the matrix of
+    the scores of every pair, like similarity_block. Once at most 1 / SPARSE_PAIR_FRACTION of the pairs have
+    a partial score below limit, the other pairs are dropped, and the remaining terms are only computed for the pairs
+    that are still below limit. The scores are exactly those that similarity_block returns.
+
+    Preconditions:
+        - features1.shape[0] == genres1.shape[0]
+        - features2.shape[0] == genres2.shape[0]
+    """
+    prune = all(weight >= 0 for _, weight, _ in _SCORE_TERMS)
+    scores = np.where(genres1[:, None] != genres2[None, :], SIMILARITY_WEIGHTING["genre"], 0.0)
+    for i, (column, weight, relative) in enumerate(_SCORE_TERMS):
+        if prune:
+            below = scores < limit
+            if np.count_nonzero(below) * SPARSE_PAIR_FRACTION <= below.size:
+                rows, columns = np.nonzero(below)
+                return _bounded_pairs(features1, features2, rows, columns, scores[rows, columns], i, limit)
+        scores += weight * _squared_differences(features1[:, column, None], features2[None, :, column], relative)
+    rows, columns = np.nonzero(scores < limit)
+    return rows, columns, scores[rows, columns]
+
+
+def _bounded_pairs(features1: np.ndarray, features2: np.ndarray, rows: np.ndarray, columns: np.ndarray,
+                   scores: np.ndarray, start: int, limit: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Add the terms of the similarity score from _SCORE_TERMS[start] onwards to the given partial scores of the pairs
+    of rows (rows[i], columns[i]) of features1 and features2, and return the rows, columns and scores of the pairs
+    whose score is less than limit, as three parallel arrays.
+
+    After each term, the pairs whose partial score has reached limit are dropped.
+    """
+    for column, weight, relative in _SCORE_TERMS[start:]:
+        scores += weight * _squared_differences(features1[rows, column], features2[columns, column], relative)
+        below = np.flatnonzero(scores < limit)
+        rows, columns, scores = rows[below], columns[below], scores[below]
+    return rows, columns, scores
+
+
+def closest_rows(features: np.ndarray, genres: np.ndarray, values: list[float], genre: int,
+                 n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the rows of the n songs with the lowest similarity score to a song with the given NUMERICAL_FEATURES
+    values and genre code, and their similarity scores, in increasing order of score with ties broken by row.
+
+    Each row of features holds the NUMERICAL_FEATURES of one song, and genres holds the genre code of each row.
+    The scores are exactly those that bounded_similarity returns. When every weight is non-negative, a song in another
+    genre scores at least SIMILARITY_WEIGHTING["genre"], so only the songs in the same genre are scored if n of them
+    score less than that. Otherwise, every song is scored.
+
+    Preconditions:
+        - features.shape == (len(genres), len(NUMERICAL_FEATURES))
+        - len(values) == len(NUMERICAL_FEATURES)
+        - n > 0
+    """
+    values = np.asarray(values, dtype=float)
+    rows = np.flatnonzero(genres == genre)
+    scores = _query_scores(features[rows], genres[rows], values, genre)
+    prune = all(weight >= 0 for _, weight, _ in _SCORE_TERMS)
+    if not prune or len(rows) < n or np.partition(scores, n - 1)[n - 1] >= SIMILARITY_WEIGHTING["genre"]:
+        rows = np.arange(len(genres))
+        scores = _query_scores(features, genres, values, genre)
+
+    if n < len(rows):
+        threshold = np.partition(scores, n - 1)[n - 1]
+        kept = np.flatnonzero(scores <= threshold)
+        rows, scores = rows[kept], scores[kept]
+    order = np.lexsort((rows, scores))[:n]
+    return rows[order], scores[order]
+
+
+def _query_scores(features: np.ndarray, genres: np.ndarray, values: np.ndarray, genre: int) -> np.ndarray:
+    """Return the similarity score between a song with the given NUMERICAL_FEATURES values and genre code
+    and each row of features, whose genre codes are genres. The scores are summed in the same order
+    as bounded_similarity.
+    """
+    scores = np.where(genres != genre, SIMILARITY_WEIGHTING["genre"], 0.0)
+    for column, weight, relative in _SCORE_TERMS:
+        scores += weight * _squared_differences(features[:, column], values[column], relative)
+    return scores
+
+
+def _squared_differences(values1: np.ndarray, values2: np.ndarray, relative: bool) -> np.ndarray:
+    """Return the squared differences between values1 and values2, broadcast against each other.
+
+    If relative is True, each difference is divided by the larger of the two values, or is 0 if that is not positive.
+    """
+    if relative:
+        largest = np.maximum(values1, values2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diff = np.where(largest > 0, np.abs(values1 - values2) / largest, 0.0)
+    else:
+        diff = values1 - values2
+    return diff * diff
+
+
+def _candidate_blocks(features: np.ndarray, block_size: int) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Yield pairs of arrays of row indices into features, such that every pair of rows whose similarity score
+    can be less than SCORE_LIMIT appears in exactly one of the yielded pairs of arrays.
+    A block paired with itself is yielded as the same array object twice.
+
+    When there are more than block_size rows, the rows are indexed in a KDTree where each feature is scaled
+    by the square root of its weight, so the squared distance between two points is the weighted part of
+    their similarity score. Tempo is left out of the index since its score is relative rather than a
+    difference, which makes the distance in the index a lower bound on the similarity score.
+    """
+    if len(features) <= block_size or any(SIMILARITY_WEIGHTING[feature_name] < 0
+                                          for feature_name in NUMERICAL_FEATURES):
+        for start in range(0, len(features), block_size):
+            block1 = np.arange(start, min(start + block_size, len(features)))
+            yield block1, block1
+            for other_start in range(start + block_size, len(features), block_size):
+                yield block1, np.arange(other_start, min(other_start + block_size, len(features)))
+    else:
+        columns = [column for column, feature_name in enumerate(NUMERICAL_FEATURES) if feature_name != "tempo"]
+        scales = np.sqrt([SIMILARITY_WEIGHTING[NUMERICAL_FEATURES[column]] for column in columns])
+        yield from KDTree(features[:, columns] * scales).close_leaf_pairs(SCORE_LIMIT)
+
+
+def _score_blocks(features: np.ndarray, genres: np.ndarray, blocks: list[tuple[np.ndarray, np.ndarray]],
+                  max_degree: Optional[int] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Score the given pairs of blocks of rows of features and return the row indices and scores of every
+    pair of rows with a similarity score less than SCORE_LIMIT, as three parallel arrays.
+
+    A block paired with itself must be the same array object twice, and each pair of rows in it is returned once.
+
+    If max_degree is not None, only the pairs that are among the max_degree best pairs of one of their rows
+    within their pair of blocks are returned. This never drops a pair that is among the max_degree best pairs
+    of one of its rows overall.
+    """
+    all_rows, all_columns, all_scores = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+    for block1, block2 in blocks:
+        rows, columns, scores = bounded_similarity_block(features[block1], genres[block1],
+                                                         features[block2], genres[block2], SCORE_LIMIT)
+        if block1 is block2:
+            upper = rows < columns
+            rows, columns, scores = rows[upper], columns[upper], scores[upper]
+        if max_degree is not None:
+            best = _best_pairs(rows, columns, scores, max_degree) | _best_pairs(columns, rows, scores, max_degree)
+            rows, columns, scores = rows[best], columns[best], scores[best]
+        all_rows.append(block1[rows])
+        all_columns.append(block2[columns])
+        all_scores.append(scores)
+    return np.concatenate(all_rows), np.concatenate(all_columns), np.concatenate(all_scores)
+
+
+def _best_pairs(rows: np.ndarray, columns: np.ndarray, scores: np.ndarray, count: int) -> np.ndarray:
+    """Return a boolean mask of the pairs (rows[i], columns[i]) that are among the count lowest scoring pairs
+    with the same row. Pairs with equal scores are ranked by column.
+    """
+    order = np.lexsort((columns, scores, rows))
+    sorted_rows = rows[order]
+    ranks = np.arange(len(order)) - np.searchsorted(sorted_rows, sorted_rows)
+    best = np.zeros(len(order), dtype=bool)
+    best[order] = ranks < count
+    return best
+
+
+def _offer_edge(heap: list[tuple[float, int]], score: float, other: int, max_degree: int) -> None:
+    """Offer an edge to the vertex other with the given score to the bounded heap of the best edges of a vertex.
+
+    The heap holds (-score, -other) for at most max_degree edges, so its first item is the worst edge kept,
+    which is replaced whenever a better edge is offered. Edges with equal scores are ranked by vertex.
+    """
+    item = (-score, -other)
+    if len(heap) < max_degree:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def _edge_worker(features: np.ndarray, genres: np.ndarray, max_degree: Optional[int] = None) \
+        -> Callable[[list[tuple[np.ndarray, np.ndarray]]], tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Return the task of a worker process of the pool used by generate_all_edges, which runs _score_blocks on
+    a tile of blocks of the graph with the given features and genres. See worker_pool.
+    """
+    return partial(_score_blocks, features, genres, max_degree=max_degree)
+
+
+def nearest_vertices(adjacency: Callable[[int], Iterable[tuple[int, float]]], origins: list[int],
+                     n: int) -> list[list[tuple[int, float]]]:
+    """Return the n vertices closest to each of the given origin vertices, where adjacency(v) returns the
+    (neighbour, edge score) pairs of vertex v and the distance between two vertices is the length of the
+    shortest path between them. The result for each origin is a list of (vertex, distance) pairs in increasing
+    order of distance, which excludes the origin itself and has fewer than n pairs if fewer than n vertices can be
+    reached from it. See iter_nearest_vertices.
+
+    Preconditions:
+        - n > 0
+        - every edge score is non-negative
+    """
+    return [[(position, score) for _, position, score in _iter_nearest_vertices(adjacency, number, origin, n)]
+            for number, origin in enumerate(origins)]
+
+
+def iter_nearest_vertices(adjacency: Callable[[int], Iterable[tuple[int, float]]], origins: list[int],
+                          n: int) -> Iterator[tuple[int, int, float]]:
+    """Yield (origin number, vertex, distance) for each of the n vertices closest to each of the given origin
+    vertices, in increasing order of distance across all the origins. See nearest_vertices.
+
+    The search from each origin is run lazily, and the searches are merged by distance, so each search only runs
+    as far as the vertices that have been yielded. Vertices at the same distance are yielded in order of origin number.
+
+    Preconditions:
+        - n > 0
+        - every edge score is non-negative
+    """
+    return heapq.merge(*[_iter_nearest_vertices(adjacency, number, origin, n) for number, origin in enumerate(origins)],
+                       key=lambda item: item[2])
+
+
+def _iter_nearest_vertices(adjacency: Callable[[int], Iterable[tuple[int, float]]], number: int, origin: int,
+                           n: int) -> Iterator[tuple[int, int, float]]:
+    """Yield (number, vertex, distance) for each of the n vertices closest to origin, in increasing order of
+    distance, as soon as its shortest path from origin is found. See nearest_vertices.
+
+    This is Dijkstra's algorithm with lazy deletion: a vertex may be in the queue several times,
+    and the entries that are longer than its shortest known path are skipped when they are popped.
+    The search stops as soon as n vertices have had their shortest path found.
+
+    Preconditions:
+        - n > 0
+        - every edge score is non-negative
+    """
+    shortest_distance = {origin: 0.0}
+    count = 0
+    queue = [(0.0, origin)]
+    # The negated lengths of the first paths found to up to n other vertices, and the longest of them once there
+    # are n. The n closest vertices are all within that bound, so longer paths are never queued.
+    found = []
+    bound = math.inf
+    while queue:
+        score, position = heapq.heappop(queue)
+        if score > shortest_distance[position]:
+            continue
+        if position != origin:
+            count += 1
+            yield number, position, score
+            if count == n:
+                return
+        for neighbour, neighbour_score in adjacency(position):
+            new_score = score + neighbour_score
+            if new_score > bound:
+                continue
+            known_score = shortest_distance.get(neighbour)
+            if known_score is None:
+                heapq.heappush(found, -new_score)
+                if len(found) > n:
+                    heapq.heappop(found)
+                if len(found) == n:
+                    bound = -found[0]
+            elif new_score >= known_score:
+                continue
+            shortest_distance[neighbour] = new_score
+            heapq.heappush(queue, (new_score, neighbour))
+
+
+def find_nearest_vertex_ids(adjacency: Callable[[int], Iterable[tuple[int, float]]], positions: dict[str, int],
+                            vertex_ids: Sequence[str], search_cache: SearchCache, orig_vertex_ids: list[str],
+                            n: int) -> list[list[tuple[str, float]]]:
+    """Return the n vertex ids closest to each of the given vertex ids, with their distances, as returned by
+    nearest_vertices for the graph with the given adjacency, where positions maps each vertex id to its vertex and
+    vertex_ids is the vertex id of each vertex. This is find_shortest_distances of both kinds of song graph.
+
+    The results are looked up in search_cache first, and the rest are computed with nearest_vertices,
+    then added to search_cache.
+
+    Preconditions:
+        - all(orig_vertex_id in positions for orig_vertex_id in orig_vertex_ids)
+        - n > 0
+    """
+    results = [search_cache.get(orig_vertex_id, n) for orig_vertex_id in orig_vertex_ids]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        nearest = nearest_vertices(adjacency, [positions[orig_vertex_ids[i]] for i in missing], n)
+        for i, res in zip(missing, nearest):
+            results[i] = [(vertex_ids[position], score) for position, score in res]
+            search_cache.put(orig_vertex_ids[i], n, results[i])
+    return results
+
+
+def iter_nearest_vertex_ids(adjacency: Callable[[int], Iterable[tuple[int, float]]], positions: dict[str, int],
+                            vertex_ids: Sequence[str], orig_vertex_ids: list[str],
+                            n: int) -> Iterator[tuple[int, str, float]]:
+    """Yield (i, vertex_id, distance) for each item of find_nearest_vertex_ids for orig_vertex_ids[i],
+    in the order they are yielded by iter_nearest_vertices, without using a search cache.
+    This is iter_shortest_distances of both kinds of song graph.
+
+    Preconditions:
+        - all(orig_vertex_id in positions for orig_vertex_id in orig_vertex_ids)
+        - n > 0
+    """
+    for number, position, score in iter_nearest_vertices(
+            adjacency, [positions[orig_vertex_id] for orig_vertex_id in orig_vertex_ids], n):
+        yield number, vertex_ids[position], score
 
 
 class SongGraph:
@@ -147,50 +529,382 @@ class SongGraph:
     A graph representing songs and their similarities where each song is a vertex and the edges between
     vertices indicate the similarity between songs.
 
+    The songs are stored column-wise: each vertex is a row number, and there is one list or array per attribute
+    holding the value of that attribute for every row. Use get_vertex to get a _Vertex view of a single song.
+
     Instance Attributes:
-        - _vertices: A dictionary mapping a song id string (vertex id) with the vertex
+        - _positions: A dictionary mapping a song id string (vertex id) to the row of the vertex
+        - _vertex_ids: The vertex id of each row
+        - _names: The name of the song in each row
+        - _artists: The artists of the song in each row
+        - _song_artists: The interned (name, artists joined by '; ') of the song in each row,
+            as shown in recommendations. See song_artist.
+        - _genres: The code of the genre of the song in each row, followed by unused space
+        - _genre_names: The genre of each genre code
+        - _genre_codes: A dictionary mapping each genre to its genre code
+        - _genre_buckets: A dictionary mapping each genre to the rows of the songs in that genre
+        - _features: A (len(NUMERICAL_FEATURES), capacity) array, where _features[_FEATURE_COLUMNS[feature_name]]
+            holds the value of the feature for each row, followed by unused space
+        - _features_view: A memoryview of _features, which is much faster to index one value at a time
+        - _neighbours: A dictionary for each row mapping the rows of its neighbours to their similarity score
+        - search_cache: The cache of the results of find_shortest_distance, which is cleared whenever an edge changes
     """
-    _vertices: dict[str, _Vertex]
+    _positions: dict[str, int]
+    _vertex_ids: list[str]
+    _names: list[str]
+    _artists: list[tuple[str, ...]]
+    _song_artists: list[tuple[str, str]]
+    _genres: np.ndarray
+    _genre_names: list[str]
+    _genre_codes: dict[str, int]
+    _genre_buckets: dict[str, list[int]]
+    _features: np.ndarray
+    _features_view: memoryview
+    _neighbours: list[dict[int, float]]
+    search_cache: SearchCache
 
     def __init__(self) -> None:
         """Initialize an empty graph"""
-        self._vertices = {}
+        self._positions = {}
+        self._vertex_ids = []
+        self._names = []
+        self._artists = []
+        self._song_artists = []
+        self._genres = np.zeros(0, dtype=np.int32)
+        self._genre_names = []
+        self._genre_codes = {}
+        self._genre_buckets = {}
+        self._features = np.zeros((len(NUMERICAL_FEATURES), 0))
+        self._features_view = memoryview(self._features)
+        self._neighbours = []
+        self.search_cache = SearchCache()
+
+    def _reserve(self, count: int) -> None:
+        """Make sure there is space for count rows in the genre and feature arrays of this graph."""
+        capacity = len(self._genres)
+        if count > capacity:
+            capacity = max(count, 2 * capacity, EDGE_BLOCK_SIZE)
+            genres = np.zeros(capacity, dtype=np.int32)
+            genres[:len(self._vertex_ids)] = self._genres[:len(self._vertex_ids)]
+            features = np.zeros((len(NUMERICAL_FEATURES), capacity))
+            features[:, :len(self._vertex_ids)] = self._features[:, :len(self._vertex_ids)]
+            self._genres, self._features = genres, features
+            self._features_view = memoryview(features)
+
+    def _genre_code(self, track_genre: str) -> int:
+        """Return the code of the given genre, adding it to this graph's genres if it is new."""
+        if track_genre not in self._genre_codes:
+            self._genre_codes[track_genre] = len(self._genre_names)
+            self._genre_names.append(track_genre)
+            self._genre_buckets[track_genre] = []
+        return self._genre_codes[track_genre]
+
+    def _feature_rows(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return a matrix with the NUMERICAL_FEATURES of each vertex as its rows,
+        and an array with the genre code of each vertex.
+        """
+        return np.ascontiguousarray(self._features[:, :len(self._vertex_ids)].T), self._genres[:len(self._vertex_ids)]
 
     def add_vertex(
-            self, vertex_id: str, name: str, artists: set[str],
+            self, vertex_id: str, name: str, artists: Iterable[str],
             danceability: str, energy: str, key: str, loudness: str,
             mode: str, speechiness: str, acousticness: str,
             instrumentalness: str, liveness: str, valence: str,
-            tempo: str, track_genre: str
+            tempo: str, track_genre: str, defer_edges: bool = False
     ) -> None:
         """Add a vertex
 
+        The artists are stored in the given order, which is the order they are shown in recommendations.
+
+        If defer_edges is True, no edges are generated for the new vertex. This is used when many vertices
+        are added at once, followed by a single call to generate_all_edges.
+
         Preconditions:
             - danceability, energy, loudness, speechiness, acousticness, instrumentalness, liveness
                 valence, and tempo are strings that can be parsed into floats
             - tempo and mode are strings that can be parsed into integers
         """
-        if vertex_id not in self._vertices:
-            self._vertices[vertex_id] = _Vertex(
-                vertex_id, name, artists,
-                danceability, energy, key, loudness,
-                mode, speechiness, acousticness,
-                instrumentalness, liveness, valence,
-                tempo, track_genre)
-            self.generate_edges(vertex_id)
+        if vertex_id not in self._positions:
+            position = len(self._vertex_ids)
+            self._reserve(position + 1)
+            values = {
+                "danceability": float(danceability), "energy": float(energy), "valence": float(valence),
+                "key": int(key), "mode": int(mode), "tempo": float(tempo), "loudness": float(loudness),
+                "speechiness": float(speechiness), "acousticness": float(acousticness),
+                "instrumentalness": float(instrumentalness), "liveness": float(liveness)
+            }
+            self._features[:, position] = [values[feature_name] for feature_name in NUMERICAL_FEATURES]
+            self._genres[position] = self._genre_code(track_genre)
+            self._positions[vertex_id] = position
+            self._vertex_ids.append(vertex_id)
+            self._names.append(name)
+            self._artists.append(tuple(artists))
+            self._song_artists.append(song_artist(name, self._artists[-1]))
+            self._neighbours.append({})
+            self._genre_buckets[track_genre].append(position)
+            if not defer_edges:
+                self.generate_edges(vertex_id)
+
+    def add_vertices(self, rows: Iterable[tuple], workers: int = 1, knn: Optional[int] = None,
+                     max_degree: Optional[int] = None, directed: bool = False) -> dict[str, Any]:
+        """Add a vertex for each of the given rows, then generate the edges of the whole graph in a single pass
+        with generate_all_edges, using the given number of worker processes and keeping at most max_degree edges
+        per vertex as described there. If knn is not None, the edges are generated with generate_knn_edges(knn)
+        instead.
+
+        Each row holds the arguments of add_vertex, from vertex_id to track_genre. Rows whose vertex_id is
+        already in the graph are skipped.
+
+        Return a dictionary with the number of vertices added, the number of edges in the graph afterwards,
+        the seconds spent adding the vertices and generating the edges, and the degree distribution of the graph
+        returned by get_degree_distribution.
+
+        Preconditions:
+            - every row satisfies the preconditions of add_vertex
+            - workers > 0
+            - knn is None or knn > 0
+            - max_degree is None or max_degree > 0
+            - knn is None or max_degree is None
+        """
+        start = time.perf_counter()
+        count = len(self._vertex_ids)
+        for row in rows:
+            self.add_vertex(*row, defer_edges=True)
+        vertex_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if knn is None:
+            self.generate_all_edges(workers=workers, max_degree=max_degree, directed=directed)
+        else:
+            self.generate_knn_edges(knn)
+        edge_seconds = time.perf_counter() - start
+
+        return {
+            'vertices_added': len(self._vertex_ids) - count,
+            'edges': sum(len(neighbours) for neighbours in self._neighbours) // (1 if directed and max_degree else 2),
+            'vertex_seconds': vertex_seconds,
+            'edge_seconds': edge_seconds,
+            'degree_distribution': self.get_degree_distribution()
+        }
+
+    def get_vertex(self, vertex_id: str) -> _Vertex:
+        """Return a view of the vertex with the given vertex_id.
+
+        Raise a ValueError if vertex_id does not appear as a vertex in this graph.
+        """
+        if vertex_id in self._positions:
+            return _Vertex(self, self._positions[vertex_id])
+        else:
+            raise ValueError
+
+    def get_row_vertex_id(self, row: int) -> str:
+        """Return the vertex id of the song in the given row."""
+        return self._vertex_ids[row]
+
+    def get_row_name(self, row: int) -> str:
+        """Return the name of the song in the given row."""
+        return self._names[row]
+
+    def get_row_artists(self, row: int) -> tuple[str, ...]:
+        """Return the artists of the song in the given row, in the order they are shown in recommendations."""
+        return self._artists[row]
+
+    def get_row_genre(self, row: int) -> str:
+        """Return the genre of the song in the given row."""
+        return self._genre_names[self._genres[row]]
+
+    def get_row_feature(self, row: int, feature_name: str) -> float | int:
+        """Return the value of the given numerical feature for the song in the given row.
+
+        Preconditions:
+            - feature_name in NUMERICAL_FEATURES
+        """
+        value = self._features_view[_FEATURE_COLUMNS[feature_name], row]
+        return int(value) if feature_name in INTEGER_FEATURES else value
+
+    def get_row_neighbours(self, row: int) -> dict[int, float]:
+        """Return a dictionary mapping the rows of the neighbours of the song in the given row
+        to their similarity score. The dictionary is the one stored in this graph, so it must not be modified.
+        """
+        return self._neighbours[row]
+
+    def get_feature_table(self) -> memoryview:
+        """Return a read-only view of the numerical features of the songs in this graph, indexed by
+        [column, row], where the columns are in the order of NUMERICAL_FEATURES. See bounded_similarity.
+        """
+        return self._features_view
 
     def generate_edges(self, vertex_id1: str) -> None:
         """Add edges to this vertex based on the similarity score of other vertices
 
+        Only the songs in the same genre are compared when genres_are_disconnected() is True.
+
         Preconditions:
-            - vertex_id1 in self._vertices
+            - vertex_id1 in self._positions
         """
-        v1 = self._vertices[vertex_id1]
-        for vertex_id2 in self._vertices:
-            if vertex_id1 != vertex_id2:
-                score = v1.get_similarity(self._vertices[vertex_id2])
-                if score < SCORE_LIMIT:
-                    self.add_edge(vertex_id1, vertex_id2, score)
+        self.search_cache.clear()
+        position1 = self._positions[vertex_id1]
+        features, genres = self._feature_rows()
+        if genres_are_disconnected():
+            candidates = np.array(self._genre_buckets[self._genre_names[genres[position1]]], dtype=np.int64)
+        else:
+            candidates = np.arange(len(self._vertex_ids))
+        _, matches, scores = bounded_similarity_block(features[[position1]], genres[[position1]],
+                                                      features[candidates], genres[candidates], SCORE_LIMIT)
+        for position2, score in zip(candidates[matches].tolist(), scores.tolist()):
+            if position2 != position1:
+                self._neighbours[position1][position2] = score
+                self._neighbours[position2][position1] = score
+
+    def generate_all_edges(self, block_size: int = EDGE_BLOCK_SIZE, workers: int = 1,
+                           max_degree: Optional[int] = None, directed: bool = False) -> None:
+        """Replace the edges of this graph with an edge between every pair of vertices whose similarity score
+        is less than SCORE_LIMIT.
+
+        This produces the same edges as calling generate_edges on every vertex, but the scores are computed
+        block_size by block_size songs at a time instead of one song at a time. Like generate_edges,
+        each genre is scored on its own when genres_are_disconnected() is True, and groups of more than
+        block_size songs are indexed with a KDTree so only the blocks that can contain an edge are scored.
+
+        If workers > 1, the blocks are split into tiles that are scored in a pool of that many processes.
+        The resulting edges are the same as with a single worker.
+
+        If max_degree is not None, each vertex only keeps its max_degree lowest scoring edges out of those,
+        ties being broken by the order the vertices were added in. The best edges of each vertex are collected
+        in a heap bounded to max_degree edges while the blocks are scored, so the full set of edges is never stored.
+        If directed is True, each vertex only has edges to the vertices it kept, so every vertex has
+        at most max_degree neighbours, but its neighbours need not have it as a neighbour. Otherwise, an edge is kept
+        in both directions if either of its vertices kept it, so some vertices have more than max_degree neighbours.
+
+        Preconditions:
+            - block_size > 0
+            - workers > 0
+            - max_degree is None or max_degree > 0
+        """
+        self.search_cache.clear()
+        features, genres = self._feature_rows()
+        self._neighbours = [{} for _ in self._vertex_ids]
+
+        if genres_are_disconnected():
+            partitions = [np.array(bucket, dtype=np.int64) for bucket in self._genre_buckets.values()]
+        else:
+            partitions = [np.arange(len(self._vertex_ids))]
+
+        blocks = []
+        for partition in partitions:
+            for block1, block2 in _candidate_blocks(features[partition], block_size):
+                rows = partition[block1]
+                blocks.append((rows, rows if block1 is block2 else partition[block2]))
+
+        if workers > 1:
+            tiles = [blocks[i::workers * TILES_PER_WORKER] for i in range(workers * TILES_PER_WORKER)]
+            with worker_pool(workers, _edge_worker, features, genres, max_degree) as executor:
+                results = executor.map(partial(run_in_worker, _edge_worker), tiles)
+                self._add_scored_edges(results, max_degree, directed)
+        else:
+            self._add_scored_edges((_score_blocks(features, genres, [block], max_degree) for block in blocks),
+                                   max_degree, directed)
+
+    def _add_scored_edges(self, results: Iterable[tuple[np.ndarray, np.ndarray, np.ndarray]],
+                          max_degree: Optional[int], directed: bool) -> None:
+        """Add the edges in the given results of _score_blocks to this graph,
+        keeping only the best max_degree edges of each vertex if max_degree is not None.
+        See generate_all_edges.
+        """
+        if max_degree is None:
+            for rows, columns, scores in results:
+                for row, column, score in zip(rows.tolist(), columns.tolist(), scores.tolist()):
+                    self._neighbours[row][column] = score
+                    self._neighbours[column][row] = score
+            return
+
+        heaps = [[] for _ in self._vertex_ids]
+        for rows, columns, scores in results:
+            for row, column, score in zip(rows.tolist(), columns.tolist(), scores.tolist()):
+                _offer_edge(heaps[row], score, column, max_degree)
+                _offer_edge(heaps[column], score, row, max_degree)
+        for row, heap in enumerate(heaps):
+            for negative_score, negative_column in heap:
+                self._neighbours[row][-negative_column] = -negative_score
+                if not directed:
+                    self._neighbours[-negative_column][row] = -negative_score
+
+    def generate_knn_edges(self, k: int, iterations: int = NN_DESCENT_ITERATIONS, seed: int = 0) -> None:
+        """Replace the edges of this graph with an approximate k-nearest neighbour graph, where each vertex
+        is joined to the k vertices with the lowest similarity score to it, regardless of SCORE_LIMIT.
+
+        The neighbours are found with nn_descent over the similarity score, doing at most the given number of
+        iterations from a random start determined by seed. Every edge goes both ways, so each vertex has at least
+        k neighbours (when the graph has more than k vertices), unlike with generate_all_edges, where a song
+        unlike any other has none and a song in a crowded genre can have thousands.
+
+        Preconditions:
+            - k > 0
+            - iterations >= 0
+        """
+        features, genres = self._feature_rows()
+        neighbours, scores = nn_descent(len(self._vertex_ids),
+                                        lambda rows, columns: paired_similarity(features[rows], genres[rows],
+                                                                                features[columns], genres[columns]),
+                                        k, iterations, seed)
+        self.search_cache.clear()
+        self._neighbours = [{} for _ in self._vertex_ids]
+        for row, (row_neighbours, row_scores) in enumerate(zip(neighbours.tolist(), scores.tolist())):
+            for column, score in zip(row_neighbours, row_scores):
+                if column >= 0:
+                    self._neighbours[row][column] = score
+                    self._neighbours[column][row] = score
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Return the vertices and edges of this graph as a dictionary of typed arrays,
+        which can be written to a snapshot file and turned back into a graph with SongGraph.from_arrays.
+
+        The vertex ids, names, artists and genres are stored in string tables, the NUMERICAL_FEATURES in a matrix
+        with a row per vertex, and the edges as compressed sparse rows: the neighbours of the i-th vertex are
+        neighbours[offsets[i]:offsets[i + 1]], with the similarity scores in the same positions of scores.
+        """
+        features, genres = self._feature_rows()
+        offsets = np.zeros(len(self._vertex_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(neighbours) for neighbours in self._neighbours])
+        return {
+            'vertex_ids': encode_strings(self._vertex_ids),
+            'names': encode_strings(self._names),
+            'artists': encode_strings([';'.join(artists) for artists in self._artists]),
+            'genre_names': encode_strings(self._genre_names),
+            'genres': genres.copy(),
+            'features': features,
+            'offsets': offsets,
+            'neighbours': np.array([neighbour for neighbours in self._neighbours for neighbour in neighbours],
+                                   dtype=np.int32),
+            'scores': np.array([score for neighbours in self._neighbours for score in neighbours.values()],
+                               dtype=np.float64)
+        }
+
+    @staticmethod
+    def from_arrays(arrays: dict[str, np.ndarray]) -> SongGraph:
+        """Return the graph stored in the given arrays, which were returned by SongGraph.to_arrays."""
+        graph = SongGraph()
+        count = len(arrays['genres'])
+        graph._reserve(count)
+        graph._vertex_ids = decode_strings(arrays['vertex_ids'], count)
+        graph._positions = {vertex_id: position for position, vertex_id in enumerate(graph._vertex_ids)}
+        graph._names = decode_strings(arrays['names'], count)
+        graph._artists = [tuple(artists.split(';')) for artists in decode_strings(arrays['artists'], count)]
+        graph._song_artists = [song_artist(name, artists) for name, artists in zip(graph._names, graph._artists)]
+        graph._genre_names = decode_strings(arrays['genre_names'], int(arrays['genres'].max(initial=-1)) + 1)
+        graph._genre_codes = {genre: code for code, genre in enumerate(graph._genre_names)}
+        graph._genre_buckets = {genre: [] for genre in graph._genre_names}
+        graph._genres[:count] = arrays['genres']
+        for position, genre in enumerate(arrays['genres'].tolist()):
+            graph._genre_buckets[graph._genre_names[genre]].append(position)
+        graph._features[:, :count] = arrays['features'].T
+
+        offsets = arrays['offsets'].tolist()
+        neighbours = arrays['neighbours'].tolist()
+        scores = arrays['scores'].tolist()
+        graph._neighbours = [dict(zip(neighbours[offsets[position]:offsets[position + 1]],
+                                      scores[offsets[position]:offsets[position + 1]])) for position in range(count)]
+        return graph
 
     def add_edge(self, vertex_id1: str, vertex_id2: str, score: float) -> None:
         """Add an edge with a score between the two vertices with the given vertex_ids in this graph.
@@ -200,27 +914,27 @@ class SongGraph:
         Preconditions:
             - vertex_id1 != vertex_id2
         """
-        if vertex_id1 in self._vertices and vertex_id2 in self._vertices:
-            v1 = self._vertices[vertex_id1]
-            v2 = self._vertices[vertex_id2]
+        if vertex_id1 in self._positions and vertex_id2 in self._positions:
+            position1 = self._positions[vertex_id1]
+            position2 = self._positions[vertex_id2]
 
-            v1.neighbours[v2] = score
-            v2.neighbours[v1] = score
+            self.search_cache.clear()
+            self._neighbours[position1][position2] = score
+            self._neighbours[position2][position1] = score
         else:
             raise ValueError
 
     def has_vertex(self, vertex_id: str) -> bool:
         """Returns whether the graph contains a vertex with the given vertex_id"""
-        return vertex_id in self._vertices
+        return vertex_id in self._positions
 
     def adjacent(self, vertex_id1: str, vertex_id2: str) -> bool:
         """Return whether vertex_id1 and vertex_id2 are adjacent vertices in this graph.
 
         Return False if vertex_id1 or vertex_id2 do not appear as vertices in this graph.
         """
-        if vertex_id1 in self._vertices and vertex_id2 in self._vertices:
-            v1 = self._vertices[vertex_id1]
-            return any(v2.vertex_id == vertex_id2 for v2 in v1.neighbours)
+        if vertex_id1 in self._positions and vertex_id2 in self._positions:
+            return self._positions[vertex_id2] in self._neighbours[self._positions[vertex_id1]]
         else:
             return False
 
@@ -229,79 +943,113 @@ class SongGraph:
 
         Raise a ValueError if vertex_id does not appear as a vertex in this graph.
         """
-        if vertex_id in self._vertices:
-            v = self._vertices[vertex_id]
-            return {neighbour.vertex_id: v.neighbours[neighbour] for neighbour in v.neighbours}
+        if vertex_id in self._positions:
+            neighbours = self._neighbours[self._positions[vertex_id]]
+            return {self._vertex_ids[neighbour]: neighbours[neighbour] for neighbour in neighbours}
         else:
             raise ValueError
 
     def get_all_vertices(self) -> set:
         """Return a set of all vertex vertex_ids in this graph.
         """
-        return set(self._vertices.keys())
+        return set(self._vertex_ids)
+
+    def iter_shortest_distances(self, orig_vertex_ids: list[str], n: int) -> Iterator[tuple[int, str, float]]:
+        """Yield (i, vertex_id, distance) for each item of find_shortest_distance(orig_vertex_ids[i], n),
+        as soon as it is found by the search from that vertex id. The searches are merged, so the items are yielded
+        in increasing order of distance across all the vertex ids. See iter_nearest_vertices.
+
+        Unlike find_shortest_distances, the search cache is not used.
+
+        Preconditions:
+            - all(self.has_vertex(orig_vertex_id) for orig_vertex_id in orig_vertex_ids)
+            - n > 0
+        """
+        return iter_nearest_vertex_ids(lambda position: self._neighbours[position].items(), self._positions,
+                                       self._vertex_ids, orig_vertex_ids, n)
+
+    def get_song_artist(self, vertex_id: str) -> tuple[str, str]:
+        """Return the name of the song with the given vertex id and its artists joined by '; ',
+        as shown in recommendations.
+
+        The tuple is looked up rather than built, so it is the same object every time.
+        """
+        return self._song_artists[self._positions[vertex_id]]
 
     def get_vertex_details(self, vertex_id: str) -> dict[str, Any]:
         """
         Given a vertex_id id, return the details of the vertex
         """
-        vertex = self._vertices[vertex_id]
-        return {
-            'name': vertex.name,
-            'artists': vertex.artists,
-            'danceability': vertex.danceability,
-            'energy': vertex.energy,
-            'key': vertex.key,
-            'loudness': vertex.loudness,
-            'mode': vertex.mode,
-            'speechiness': vertex.speechiness,
-            'acousticness': vertex.acousticness,
-            'instrumentalness': vertex.instrumentalness,
-            'liveness': vertex.liveness,
-            'valence': vertex.valence,
-            'tempo': vertex.tempo,
-            'track_genre': vertex.track_genre
-        }
+        position = self._positions[vertex_id]
+        details = {'name': self._names[position], 'artists': set(self._artists[position])}
+        for feature_name, value in zip(NUMERICAL_FEATURES, self._features[:, position].tolist()):
+            details[feature_name] = int(value) if feature_name in INTEGER_FEATURES else value
+        details['track_genre'] = self._genre_names[self._genres[position]]
+        return details
+
+    def find_closest_songs(self, track_genre: str, values: list[float], n: int) -> list[tuple[str, float]]:
+        """Return the vertex ids of the n songs most similar to a song in the given genre with the given
+        NUMERICAL_FEATURES values, which need not be in the graph, with their similarity scores to it.
+
+        The songs are compared directly with the similarity score rather than through the edges of the graph,
+        and are returned in increasing order of score, with ties broken by vertex number. See closest_rows.
+
+        Preconditions:
+            - len(values) == len(NUMERICAL_FEATURES)
+            - n > 0
+        """
+        count = len(self._vertex_ids)
+        rows, scores = closest_rows(self._features[:, :count].T, self._genres[:count], values,
+                                    self._genre_codes.get(track_genre, -1), n)
+        return [(self._vertex_ids[row], score) for row, score in zip(rows.tolist(), scores.tolist())]
 
     def get_average_edges(self) -> float:
         """Returns the average number of edges per vertex.
         Used to decide a value for the SCORE_LIMIT constant
         """
-        return sum(len(self._vertices[vid].neighbours) for vid in self._vertices) / (len(self._vertices))
+        return sum(len(neighbours) for neighbours in self._neighbours) / (len(self._vertex_ids))
+
+    def get_degree_distribution(self) -> dict[int, int]:
+        """Return a dictionary mapping each degree to the number of vertices with that degree, in increasing order
+        of degree. The degree of a vertex is its number of neighbours.
+        """
+        degrees = np.bincount([len(neighbours) for neighbours in self._neighbours], minlength=1)
+        return {degree: count for degree, count in enumerate(degrees.tolist()) if count > 0}
 
     def find_shortest_distance(self, orig_vertex_id: str, n: int) -> list[tuple[Any, Any]]:
         """
         Given the id of a song in the graph, find n other songs that
         are similar to the song and return their vertex_ids in a list.
 
+        The songs are the n songs with the shortest path from the given song, where the length of a path is the sum
+        of the similarity scores of its edges. Each song is returned with the length of its shortest path,
+        in increasing order of length. Fewer than n songs are returned if fewer than n songs can be reached.
+        The search stops as soon as n songs have had their shortest path found. See nearest_vertices.
+
+        Preconditions:
+            - self.has_vertex(orig_vertex_id)
+            - n > 0
+        """
+        return self.find_shortest_distances([orig_vertex_id], n)[0]
+
+    def find_shortest_distances(self, orig_vertex_ids: list[str], n: int) -> list[list[tuple[str, float]]]:
+        """Return find_shortest_distance(orig_vertex_id, n) for each of the given vertex ids.
+
+        The results are looked up in search_cache first, and the rest are computed with nearest_vertices,
+        then added to search_cache. See find_nearest_vertex_ids.
+
         Preconditions:
-            - orig_vertex_id in self.graph._vertices
+            - all(self.has_vertex(orig_vertex_id) for orig_vertex_id in orig_vertex_ids)
             - n > 0
         """
-        shortest_distance = {orig_vertex_id: 0}
-
-        queue = [(0.0, orig_vertex_id)]
-        visited = set()
-        while queue and len(shortest_distance) + 1 < n:
-            score, vertex_id = heapq.heappop(queue)
-            visited.add(vertex_id)
-            neighbours = self.get_neighbours(vertex_id)
-            for neighbour in neighbours:
-                neighbour_score = neighbours[neighbour]
-                if neighbour not in shortest_distance:
-                    shortest_distance[neighbour] = float('inf')
-                shortest_distance[neighbour] = min(shortest_distance[neighbour], score + neighbour_score)
-
-                if neighbour not in visited:
-                    heapq.heappush(queue, (score + neighbour_score, neighbour))
-        del shortest_distance[orig_vertex_id]
-        res = [(key, shortest_distance[key]) for key in shortest_distance]
-        res.sort(key=lambda x: x[1])
-        return res[:n]
+        return find_nearest_vertex_ids(lambda position: self._neighbours[position].items(), self._positions,
+                                       self._vertex_ids, self.search_cache, orig_vertex_ids, n)
 
 
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['heapq'],
+        'extra-imports': ['heapq', 'math', 'sys', 'time', 'functools', 'numpy', 'nn_descent', 'search_cache',
+                          'snapshot', 'spatial_index', 'worker_pool'],
         'max-line-length': 120,
     })
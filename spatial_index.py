@@ -0,0 +1,132 @@
+"""
+A module that contains the KDTree class, a spatial index that SongGraph uses to find the groups of songs
+that are close enough to be joined by an edge, without scoring every pair of songs.
+"""
+from __future__ import annotations
+
+from typing import Iterator
+
+import numpy as np
+
+# The max number of points stored in a leaf of the tree
+LEAF_SIZE = 128
+# The relative amount added to a radius so that rounding errors never prune a pair of points inside the radius
+RADIUS_SLACK = 1e-9
+
+
+class KDTree:
+    """A k-d tree over a fixed set of points, where every node stores the bounding box of its points.
+
+    The nodes are stored in flat lists indexed by node number, with the root as node 0.
+
+    Instance Attributes:
+        - points: A (n, d) array containing the points in this tree
+        - order: The indices of the points, arranged so that the points of each node are contiguous
+
+    Representation Invariants:
+        - sorted(self.order.tolist()) == list(range(len(self.points)))
+    """
+    points: np.ndarray
+    order: np.ndarray
+    # Private Instance Attributes:
+    #   - _starts, _stops:
+    #       The points of node i are self.order[self._starts[i]:self._stops[i]]
+    #   - _lows, _highs:
+    #       The smallest and largest coordinates of the points of each node
+    #   - _children:
+    #       The (left, right) children of each node, or None if the node is a leaf
+    _starts: list[int]
+    _stops: list[int]
+    _lows: list[np.ndarray]
+    _highs: list[np.ndarray]
+    _children: list[tuple[int, int] | None]
+
+    def __init__(self, points: np.ndarray, leaf_size: int = LEAF_SIZE) -> None:
+        """Build a tree over the given (n, d) array of points.
+
+        Each node is split at the median of the coordinate where its points are most spread out,
+        until every leaf has at most leaf_size points.
+
+        Preconditions:
+            - len(points.shape) == 2
+            - leaf_size > 0
+        """
+        self.points = points
+        self.order = np.arange(len(points))
+        self._starts, self._stops, self._lows, self._highs, self._children = [], [], [], [], []
+
+        self._add_node(0, len(points))
+        stack = [0] if len(points) > 0 else []
+        while stack:
+            node = stack.pop()
+            start, stop = self._starts[node], self._stops[node]
+            if stop - start <= leaf_size:
+                continue
+            axis = int(np.argmax(self._highs[node] - self._lows[node]))
+            middle = (stop - start) // 2
+            indices = self.order[start:stop]
+            indices[:] = indices[np.argpartition(self.points[indices, axis], middle)]
+            left = self._add_node(start, start + middle)
+            right = self._add_node(start + middle, stop)
+            self._children[node] = (left, right)
+            stack.extend([left, right])
+
+    def _add_node(self, start: int, stop: int) -> int:
+        """Add a leaf containing the points self.order[start:stop] and return its node number."""
+        node_points = self.points[self.order[start:stop]]
+        self._starts.append(start)
+        self._stops.append(stop)
+        if stop > start:
+            self._lows.append(node_points.min(axis=0))
+            self._highs.append(node_points.max(axis=0))
+        else:
+            self._lows.append(np.zeros(self.points.shape[1]))
+            self._highs.append(np.zeros(self.points.shape[1]))
+        self._children.append(None)
+        return len(self._starts) - 1
+
+    def _box_distance(self, node1: int, node2: int) -> float:
+        """Return the smallest squared distance between the bounding boxes of the two nodes."""
+        gaps = np.maximum(np.maximum(self._lows[node2] - self._highs[node1], self._lows[node1] - self._highs[node2]),
+                          0.0)
+        return float(np.dot(gaps, gaps))
+
+    def close_leaf_pairs(self, radius_squared: float) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield pairs of arrays of point indices such that every pair of points whose squared distance
+        is less than radius_squared appears in exactly one of the yielded pairs of arrays.
+
+        Each yielded pair is either a leaf paired with itself (both arrays are the same object),
+        or two different leaves whose bounding boxes are within the radius of each other.
+        """
+        limit = radius_squared * (1 + RADIUS_SLACK)
+        stack = [(0, 0)] if len(self.points) > 0 else []
+        while stack:
+            node1, node2 = stack.pop()
+            if node1 != node2 and self._box_distance(node1, node2) >= limit:
+                continue
+            children1, children2 = self._children[node1], self._children[node2]
+            if children1 is None and children2 is None:
+                indices = self.order[self._starts[node1]:self._stops[node1]]
+                if node1 == node2:
+                    yield indices, indices
+                else:
+                    yield indices, self.order[self._starts[node2]:self._stops[node2]]
+            elif node1 == node2:
+                left, right = children1
+                stack.extend([(left, left), (left, right), (right, right)])
+            elif children2 is None or (children1 is not None and self._size(node1) >= self._size(node2)):
+                stack.extend([(children1[0], node2), (children1[1], node2)])
+            else:
+                stack.extend([(node1, children2[0]), (node1, children2[1])])
+
+    def _size(self, node: int) -> int:
+        """Return the number of points in the given node."""
+        return self._stops[node] - self._starts[node]
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['numpy'],
+        'max-line-length': 120,
+    })
@@ -0,0 +1,45 @@
+"""
+This module contains the helpers that run tasks in a pool of worker processes which each hold the same large objects,
+such as a song graph. The objects are set up once in each worker process when the pool starts, rather than being
+sent to the workers with every task.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+# A dictionary mapping each setup function of a pool that this process is a worker of to the task function it
+# returned, which holds the objects it set up. It is filled by _init_worker.
+WORKER_TASKS: dict[Callable[..., Callable], Callable] = {}
+
+
+def worker_pool(workers: int, setup: Callable[..., Callable], *args: Any) -> ProcessPoolExecutor:
+    """Return a pool of the given number of worker processes, where setup(*args) is called once in each worker
+    when it starts, and returns the function that runs the tasks of that worker.
+    Submit each task to the pool as run_in_worker(setup, *task_args).
+
+    setup and args are sent to each worker, so they must be picklable, and setup must be defined at the top level
+    of a module.
+
+    Preconditions:
+        - workers > 0
+    """
+    return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(setup, *args))
+
+
+def run_in_worker(setup: Callable[..., Callable], *args: Any) -> Any:
+    """Return task(*args), where task is the function returned by setup in this worker process of a pool
+    created by worker_pool.
+    """
+    return WORKER_TASKS[setup](*args)
+
+
+def _init_worker(setup: Callable[..., Callable], *args: Any) -> None:
+    """Store the task function returned by setup(*args) in this worker process."""
+    WORKER_TASKS[setup] = setup(*args)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['concurrent.futures'],
+        'max-line-length': 120,
+    })